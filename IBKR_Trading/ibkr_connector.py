@@ -1,41 +1,195 @@
 import asyncio
+import copy
+import gc
 import logging
+import queue
+import re
+import socket
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from heapq import merge
+from itertools import groupby
+from math import isnan
+from operator import attrgetter
+
+import numpy as np
+import pandas as pd
 
-# Ensure an event loop exists BEFORE importing ib_async.
-# ib_async's dependency (eventkit) calls get_event_loop() at module level.
-# In Streamlit's ScriptRunner thread, no event loop exists by default.
-try:
-    asyncio.get_event_loop()
-except RuntimeError:
-    asyncio.set_event_loop(asyncio.new_event_loop())
+# ib_async names, bound by _load_ib() the first time a connector is built so
+# that merely importing this module doesn't pay for ib_async / eventkit.
+IB = Stock = Option = Contract = ComboLeg = LimitOrder = MarketOrder = None
 
-import sys
 
-# On Python 3.14+, nest_asyncio 1.6.0 is broken (RuntimeError: Timeout should
-# be used inside a task).  We force the maintained fork (nest_asyncio2) into
-# sys.modules so that *every* library (including ib_async internals) that does
-# "import nest_asyncio" will transparently get the fixed version.
-try:
-    import nest_asyncio2 as _na2  # type: ignore[import-untyped]
-
-    sys.modules["nest_asyncio"] = _na2
-    nest_asyncio = _na2
-except ImportError:
-    import nest_asyncio  # fallback for envs where nest_asyncio2 isn't installed
-
-nest_asyncio.apply()
-
-from ib_async import (
-    IB,
-    Stock,
-    Option,
-    Contract,
-    ComboLeg,
-    LimitOrder,
-    MarketOrder,
-    util,
-)
-import pandas as pd
+def _load_ib():
+    """Import ib_async on first use and bind its names at module level.
+
+    Called on the connector's IB loop thread: ib_async's dependency (eventkit)
+    calls get_event_loop() at import time, and that thread always has one.
+    """
+    global IB, Stock, Option, Contract, ComboLeg, LimitOrder, MarketOrder
+    if IB is not None:
+        return
+
+    # On Python 3.14+, nest_asyncio 1.6.0 is broken (RuntimeError: Timeout
+    # should be used inside a task).  We force the maintained fork
+    # (nest_asyncio2) into sys.modules so that *every* library (including
+    # ib_async internals) that does "import nest_asyncio" will transparently
+    # get the fixed version.  The connector itself never nests event loops.
+    try:
+        import nest_asyncio2 as _na2  # type: ignore[import-untyped]
+
+        sys.modules["nest_asyncio"] = _na2
+    except ImportError:
+        pass
+
+    from ib_async import (
+        IB,
+        Stock,
+        Option,
+        Contract,
+        ComboLeg,
+        LimitOrder,
+        MarketOrder,
+    )
+
+
+def _valid(x):
+    """True for a populated tick value (ib_async uses NaN for "not yet")."""
+    return not isnan(x) and x != 0.0
+
+
+def _has_model_iv(t):
+    """True once a Ticker carries a populated model implied volatility."""
+    greeks = t.modelGreeks
+    if greeks is None:
+        return False
+    iv = greeks.impliedVol
+    return iv is not None and not isnan(iv) and iv != 0.0
+
+
+def _qual_key(c):
+    """Cache key identifying a contract as requested, before qualification."""
+    return (
+        c.symbol,
+        c.secType,
+        c.exchange,
+        c.currency,
+        c.lastTradeDateOrContractMonth,
+        float(c.strike),
+        c.right,
+    )
+
+
+def _positive(x):
+    """True for a populated, strictly positive price tick."""
+    return x is not None and not isnan(x) and x > 0
+
+
+def _mid_price(bid, ask):
+    """Bid/ask midpoint to 4 decimals, computed in integer ten-thousandths.
+
+    Quotes are tick-quantized, so the scaled sum is exact and avoids the
+    float drift of round((bid + ask) / 2, 4); a half ten-thousandth rounds up.
+    """
+    return (round(bid * 10000) + round(ask * 10000) + 1) // 2 / 10000.0
+
+
+def _stock_key(ticker, exchange, currency):
+    """_qual_key() of Stock(ticker, exchange, currency), without building it."""
+    return (ticker, "STK", exchange, currency, "", 0.0, "")
+
+
+@lru_cache(maxsize=1024)
+def _option_template(ticker, expiry, exchange, currency):
+    """Cached Option with blank strike/right for one (ticker, expiry).
+
+    Never qualified or mutated itself: used as-is for whole-expiry contract
+    details probes and copied by _option() for concrete contracts.
+    """
+    return Option(ticker, expiry, 0.0, "", exchange, "", currency)
+
+
+def _option(ticker, expiry, strike, right, exchange="SMART", currency="USD"):
+    """Build an Option by copying the cached template, skipping Option.__init__."""
+    contract = copy.copy(_option_template(ticker, expiry, exchange, currency))
+    contract.strike = float(strike)
+    contract.right = right
+    return contract
+
+
+@dataclass(slots=True)
+class _LegSpec:
+    """A qualified strategy leg, ready to become a ComboLeg."""
+
+    contract: "Contract"
+    action: str
+    ratio: int
+
+
+# volume stays float: IBKR reports fractional sizes for some instruments
+_BAR_DTYPES = {
+    "open": "float64",
+    "high": "float64",
+    "low": "float64",
+    "close": "float64",
+    "volume": "float64",
+    "average": "float64",
+    "barCount": "int64",
+}
+
+
+# Bar count above which a finished fetch triggers an explicit gc.collect()
+_GC_BAR_THRESHOLD = 50_000
+
+
+def _collect_if_large(n_bars):
+    """Run a GC pass after very large fetches so freed bar memory is reclaimed."""
+    if n_bars > _GC_BAR_THRESHOLD:
+        gc.collect()
+
+
+def _bars_to_df(bars):
+    """Build a date-indexed OHLCV DataFrame from a list of BarData.
+
+    Equivalent to util.df(bars).set_index("date") but builds the frame
+    column by column, with its index, in a single construction: no
+    per-row dicts, no row-to-column pivot and no set_index copy.  Each
+    numeric column is streamed straight into a preallocated typed array by
+    mapping a C-level attrgetter over the bars, so there is neither an
+    intermediate Python list nor a Python-level generator frame per bar.
+    """
+    if not bars:
+        return None
+    n = len(bars)
+    cols = {
+        field: np.fromiter(map(attrgetter(field), bars), dtype=dtype, count=n)
+        for field, dtype in _BAR_DTYPES.items()
+    }
+    index = pd.Index(list(map(attrgetter("date"), bars)), name="date")
+    return pd.DataFrame(cols, index=index, copy=False)
+
+
+def _bars_to_arrow(bars):
+    """Build a columnar pyarrow.Table from a list of BarData.
+
+    pyarrow is imported lazily so the connector does not require it unless
+    this path is used.
+    """
+    if not bars:
+        return None
+    import pyarrow as pa
+
+    cols = {"date": pa.array([b.date for b in bars])}
+    for field, dtype in _BAR_DTYPES.items():
+        cols[field] = pa.array(
+            [getattr(b, field) for b in bars], type=pa.from_numpy_dtype(dtype)
+        )
+    return pa.table(cols)
 
 
 class _IBKRInfoFilter(logging.Filter):
@@ -47,17 +201,31 @@ class _IBKRInfoFilter(logging.Filter):
     avoids noise in the Streamlit terminal and application logs.
     """
 
-    _SUPPRESSED = frozenset((10091, 10089))
+    # One precompiled scan per record instead of four substring searches
+    _SUPPRESSED = re.compile(r"Error (?:10091|10089)[ ,]")
 
     def filter(self, record: logging.LogRecord) -> bool:  # noqa: A003
-        msg = record.getMessage()
-        for code in self._SUPPRESSED:
-            if f"Error {code}," in msg or f"Error {code} " in msg:
-                return False  # Drop this log record
-        return True
+        # Look at the unformatted template first: ib_async logs errors
+        # pre-formatted, and records without "Error" in the template can't
+        # match, so msg % args is only paid for templated error records.
+        raw = record.msg if isinstance(record.msg, str) else str(record.msg)
+        if not record.args:
+            return not self._SUPPRESSED.search(raw)
+        if "Error" not in raw:
+            return True
+        return not self._SUPPRESSED.search(record.getMessage())
+
+
+# Informational codes dropped by IBKRConnector._on_error:
+# 10091 = delayed data availability notice (not a real error)
+# 10089 = not a firm quote (informational)
+# 399  = order message (informational)
+_IGNORED_CODES = frozenset((10091, 10089, 399))
 
 
 # Apply filter to the ib_async logger and its children
+logger = logging.getLogger(__name__)
+
 _ib_logger = logging.getLogger("ib_async")
 _ib_logger.addFilter(_IBKRInfoFilter())
 
@@ -65,41 +233,95 @@ _ib_logger.addFilter(_IBKRInfoFilter())
 class IBKRConnector:
     """Connector for Interactive Brokers via ib_async.
 
-    Handles the event-loop mismatch caused by Streamlit's ScriptRunner thread:
-    after st.rerun(), the thread may have a NEW event loop, but the IB socket
-    is still listening on the OLD one.  _ensure_loop() re-attaches the saved
-    loop before every IB call so util.run() / loop.run_until_complete() work.
+    The IB socket lives on a private event loop that runs forever in a
+    daemon thread owned by the connector.  Streamlit's ScriptRunner may call
+    in from a different thread (with a different current loop) on every
+    st.rerun(); public methods therefore never touch the caller's loop and
+    instead hand their work to the IB loop with run_coroutine_threadsafe
+    (see _run / _call).  All ib_async objects are only used on that thread.
     """
 
+    # Seconds a reqSecDefOptParams result is reused by get_option_chain
+    _CHAIN_TTL = 60.0
+    # Seconds an expiry's contract details are reused; conIds don't change
+    # intra-session, this only bounds how long a listing can go stale.
+    _CHAIN_DETAILS_TTL = 900.0
+
+    # 10167 = market data not subscribed, 10168 = delayed data not enabled
+    _NO_DATA_CODES = frozenset((10167, 10168))
+
     def __init__(self, request_timeout=30):
-        self.ib = IB()
+        # Dedicated loop for all IB socket I/O, kept running for the lifetime
+        # of the connector so reruns always find the same loop and socket.
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(
+            target=self._loop.run_forever, name="ibkr-loop", daemon=True
+        )
+        self._loop_thread.start()
+        self._call(_load_ib)
+        self.ib = self._call(IB)
         self.ib.RequestTimeout = request_timeout
         self.connected = False
-        # Save the event loop that IB will use for its socket I/O.
-        # This is the loop active when the connector is created.
-        try:
-            self._loop = asyncio.get_event_loop()
-        except RuntimeError:
-            self._loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(self._loop)
+        # Qualified contracts keyed by _qual_key(): stocks and options alike.
+        # Kept for the connector's lifetime, across reconnects.
+        self._qual_cache = {}
+        # ticker -> (fetched_at, reqSecDefOptParams result), see _CHAIN_TTL
+        self._chain_cache = {}
+        # (ticker, expiry, currency) -> (fetched_at, {(strike, right): Contract}),
+        # see _CHAIN_DETAILS_TTL
+        self._chain_details_cache = {}
+        # (ticker, expiry, currency) -> Task of a contract-details probe that
+        # is still in flight, so concurrent callers share one request
+        self._chain_details_pending = {}
+        # Request caps: TWS allows 100 market data lines and 50 concurrent
+        # historical requests; keep some headroom under both.
+        self._mkt_sem = asyncio.Semaphore(90)
+        self._hist_sem = asyncio.Semaphore(45)
+        # Send times of recent requests, for the 50 msg/s pacing gate
+        self._sent = deque()
+        # id(bars) -> updateEvent handler attached by subscribe_bars
+        self._bar_handlers = {}
         # Suppress noisy informational errors — Error 10091 is emitted by TWS
         # whenever delayed data is used instead of real-time. It's not a failure;
         # data still arrives correctly. We log it at DEBUG level only.
         self.ib.errorEvent += self._on_error  # type: ignore[operator]
+        # Codes dropped before ib_async's own EWrapper.error sees them, and
+        # per-code callbacks run ahead of it (see _patch_wrapper_error).  Each
+        # code holds a list: the connector is shared by every Streamlit
+        # session, so concurrent callers register and remove their own hooks.
+        self._silent_codes = frozenset((10091, 10089))
+        self._error_hooks = {}
+        self._wrapper_error = None
+        # Track socket state from ib_async's own events so is_ready() is a
+        # plain attribute read instead of a connection probe per call.
+        self.ib.connectedEvent += self._on_connected  # type: ignore[operator]
+        self.ib.disconnectedEvent += self._on_disconnected  # type: ignore[operator]
+
+    def _on_connected(self):
+        self.connected = True
+
+    def _on_disconnected(self):
+        self.connected = False
 
     @staticmethod
     def _on_error(req_id: int, error_code: int, error_string: str, contract):
         """Centralized IBKR error handler. Demotes noisy informational codes."""
-        if error_code in (10091, 10089, 399):
-            # 10091 = delayed data availability notice (not a real error)
-            # 10089 = not a firm quote (informational)
-            # 399  = order message (informational)
+        if error_code in _IGNORED_CODES:
             return  # Silently ignore — data still arrives correctly
-        # For all other codes, print normally so real errors are visible
-        print(
-            f"[IBKR Error {error_code}] reqId={req_id}: "
-            f"{error_string}" + (f" | Contract: {contract}" if contract else "")
-        )
+        # For all other codes, log normally so real errors are visible.
+        # Formatting is left to logging, so nothing is built when disabled.
+        if contract:
+            logger.warning(
+                "[IBKR Error %s] reqId=%s: %s | Contract: %s",
+                error_code,
+                req_id,
+                error_string,
+                contract,
+            )
+        else:
+            logger.warning(
+                "[IBKR Error %s] reqId=%s: %s", error_code, req_id, error_string
+            )
 
     def _patch_wrapper_error(self):
         """Monkey-patch ib_async's internal EWrapper.error to suppress Error 10091/10089.
@@ -109,57 +331,354 @@ class IBKRConnector:
         Python logging module entirely.  We wrap that method here to intercept and
         drop purely informational codes before they appear in the Streamlit log.
         """
-        _SILENT = frozenset((10091, 10089))
-        original_error = self.ib.wrapper.error  # type: ignore[attr-defined]
+        # The IB object (and its wrapper) outlives reconnects: install the
+        # dispatcher once instead of stacking another closure per connect().
+        if self._wrapper_error is not None:
+            return
+        self._wrapper_error = self.ib.wrapper.error  # type: ignore[attr-defined]
+        self.ib.wrapper.error = self._dispatch_error  # type: ignore[method-assign]
+
+    def _dispatch_error(self, req_id, error_code, error_string, contract=""):
+        """The single EWrapper.error replacement: drop, hook, then forward."""
+        if error_code in self._silent_codes:
+            return  # Drop silently — delayed data notice, not a real failure
+        # Snapshot the list: callers on other threads may remove their hook
+        for hook in tuple(self._error_hooks.get(error_code, ())):
+            hook(req_id, error_code, error_string, contract)
+        self._wrapper_error(req_id, error_code, error_string, contract)
+
+    def _gather(self, *aws):
+        """Run awaitables concurrently on the IB loop and return their results.
+
+        All requests share the single ib_async socket, so N independent
+        requests cost roughly one TWS round-trip instead of N.
+        """
+
+        async def _all():
+            return await asyncio.gather(*aws)
+
+        return self._run(_all())
+
+    def _run(self, aw):
+        """Run a single awaitable on the IB loop thread and wait for its result.
+
+        Must not be called from the IB loop thread itself (e.g. from an event
+        handler), since it blocks until the loop has run ``aw``.
+        """
+        return asyncio.run_coroutine_threadsafe(aw, self._loop).result()
+
+    def _call(self, fn, *args, **kwargs):
+        """Run a plain (non-async) ib_async call on the IB loop thread."""
+
+        async def _invoke():
+            return fn(*args, **kwargs)
+
+        return self._run(_invoke())
+
+    async def _await_ticker(self, ticker_data, ready, timeout):
+        """Wait until ready(ticker_data) holds or the timeout expires.
+
+        Resolves from the Ticker's updateEvent, so it returns as soon as TWS
+        pushes the tick instead of waking up every 100 ms to poll.  Gives up
+        immediately if TWS reports that no market data is available for the
+        ticker's contract (errors 10167 / 10168) rather than sitting out the
+        full timeout.
+        Returns True if the condition was met, False on timeout or error.
+        """
+        if ready(ticker_data):
+            return True
+        fut = asyncio.get_running_loop().create_future()
+        con_id = ticker_data.contract.conId if ticker_data.contract else None
+
+        def _on_update(t):
+            if not fut.done() and ready(t):
+                fut.set_result(True)
+
+        def _on_error(req_id, error_code, error_string, contract):
+            if (
+                error_code in self._NO_DATA_CODES
+                and not fut.done()
+                and contract is not None
+                and contract.conId == con_id
+            ):
+                fut.set_result(False)
+
+        ticker_data.updateEvent += _on_update
+        self.ib.errorEvent += _on_error  # type: ignore[operator]
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            ticker_data.updateEvent -= _on_update
+            self.ib.errorEvent -= _on_error  # type: ignore[operator]
+
+    async def _req_mkt_data(
+        self, contract, generic_ticks, ready, timeout, snapshot=False, clear=()
+    ):
+        """Request market data and wait for ready(ticker) under the line cap.
 
-        def _filtered_error(req_id, error_code, error_string, contract=""):
-            if error_code in _SILENT:
-                return  # Drop silently — delayed data notice, not a real failure
-            original_error(req_id, error_code, error_string, contract)
+        Holds a slot of self._mkt_sem for the lifetime of the request so bursts
+        stay under TWS's 100 concurrent market data lines, and always cancels
+        streaming requests afterwards.  ``clear`` lists Ticker fields reset to
+        NaN before waiting, so stale values from an earlier request on the
+        same contract are not mistaken for fresh ones.
 
-        self.ib.wrapper.error = _filtered_error  # type: ignore[method-assign]
+        Both the request and its cancel pass through the _gate pacing window,
+        so gathered snapshot grids stay under TWS's 50 msg/s limit.
 
-    def _ensure_loop(self):
-        """Re-attach the IB event loop to the current thread.
+        Returns (ticker, ready_flag).
+        """
+        async with self._mkt_sem:
+            await self._gate()
+            ticker_data = self.ib.reqMktData(
+                contract, generic_ticks, snapshot=snapshot, regulatorySnapshot=False
+            )
+            for field in clear:
+                setattr(ticker_data, field, float("nan"))
+            try:
+                ok = await self._await_ticker(ticker_data, ready, timeout)
+            finally:
+                if not snapshot:
+                    await self._gate()
+                    self.ib.cancelMktData(contract)
+        return ticker_data, ok
+
+    async def _wait_status(self, trade, timeout=0.5):
+        """Wait for the next order status update on trade, or until timeout.
 
-        Streamlit's ScriptRunner re-creates threads on st.rerun(), which may
-        result in a different event loop being the 'current' one.  IB's socket
-        traffic is still on self._loop, so we must make it current again.
+        Returns the reported status string, or None if nothing arrived in time.
         """
+        fut = asyncio.get_running_loop().create_future()
+
+        def _on_status(t):
+            if t.orderStatus.status and not fut.done():
+                fut.set_result(t.orderStatus.status)
+
+        trade.statusEvent += _on_status
         try:
-            current = asyncio.get_event_loop()
-        except RuntimeError:
-            current = None
-        if current is not self._loop:
-            asyncio.set_event_loop(self._loop)
-            nest_asyncio.apply(self._loop)
-            print(f"[IBKR] Re-attached event loop {id(self._loop):#x}")
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            trade.statusEvent -= _on_status
+
+    def _qualify(self, contract):
+        """Qualify a contract, reusing the result for later calls.
+
+        Returns the qualified contract, or None if TWS does not know it.
+        """
+        key = _qual_key(contract)
+        cached = self._qual_cache.get(key)
+        if cached is not None:
+            return cached
+        qualified = self._run(self._qualify_one(contract))
+        if qualified is None:
+            return None
+        self._qual_cache[key] = qualified
+        return qualified
+
+    def _qualify_stock(self, ticker, exchange="SMART", currency="USD"):
+        """Qualify an underlying stock through the contract cache."""
+        # Look up by key first so cache hits don't even build a Stock, nor
+        # hop onto the IB loop
+        cached = self._qual_cache.get(_stock_key(ticker, exchange, currency))
+        if cached is not None:
+            return cached
+        return self._run(self._qualify_stock_async(ticker, exchange, currency))
+
+    async def _qualify_stock_async(self, ticker, exchange="SMART", currency="USD"):
+        """The one place stocks are qualified; results live in _qual_cache.
+
+        Shared by the sync helpers (option chain, historical data, IV
+        fallback) and the concurrent historical fetches, so a symbol is
+        qualified once per connection whichever path sees it first.
+        """
+        key = _stock_key(ticker, exchange, currency)
+        contract = self._qual_cache.get(key)
+        if contract is None:
+            contract = await self._qualify_one(Stock(ticker, exchange, currency))
+            if contract is not None:
+                self._qual_cache[key] = contract
+        return contract
+
+    # TWS disconnects clients that exceed 50 API messages per second (Error 100)
+    _MAX_MSGS_PER_SEC = 50
+
+    async def _gate(self, n=1):
+        """Wait until n more requests fit in the 50 msg/s window, then claim them.
+
+        A sliding window of send times is kept on the connector; requests are
+        released as soon as the window allows, without a fixed sleep.
+        """
+        sent = self._sent
+        while True:
+            now = time.monotonic()
+            while sent and now - sent[0] >= 1.0:
+                sent.popleft()
+            if len(sent) + n <= self._MAX_MSGS_PER_SEC:
+                sent.extend([now] * n)
+                return
+            await asyncio.sleep(sent[0] + 1.0 - now)
+
+    async def _throttled(self, fn, *args, n=1, **kwargs):
+        """Call ``fn(*args, **kwargs)`` once the pacing gate admits n requests.
+
+        Takes the callable rather than an awaitable because several ib_async
+        *Async methods send their request as soon as they are called.
+        """
+        await self._gate(n)
+        return await fn(*args, **kwargs)
+
+    async def _qualify_one(self, contract):
+        """Qualify a single contract. Returns the qualified contract or None."""
+        qualified = await self._throttled(self.ib.qualifyContractsAsync, contract)
+        return qualified[0] if qualified and qualified[0] else None
+
+    async def _chain_details(self, ticker, expiry, currency="USD"):
+        """Return {(strike, right): Contract} for every option on one expiry.
+
+        A single reqContractDetails with blank strike and right lists the whole
+        expiry in one round-trip; the result is cached per connection for
+        _CHAIN_DETAILS_TTL seconds and shared by leg qualification, IV lookups,
+        the greeks grid and strike listings.  A key listed under several
+        contracts, with no single standard listing among them, maps to None.
+        """
+        key = (ticker, expiry, currency)
+        hit = self._chain_details_cache.get(key)
+        if hit is not None and time.monotonic() - hit[0] < self._CHAIN_DETAILS_TTL:
+            return hit[1]
+        # Legs of one combo are qualified concurrently and usually share an
+        # expiry: the first caller sends the probe, the others await its task.
+        task = self._chain_details_pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._probe_chain(key))
+            self._chain_details_pending[key] = task
+            task.add_done_callback(
+                lambda _t: self._chain_details_pending.pop(key, None)
+            )
+        return await asyncio.shield(task)
+
+    async def _probe_chain(self, key):
+        """Send the contract-details probe behind _chain_details."""
+        ticker, expiry, currency = key
+        details = await self._throttled(
+            self.ib.reqContractDetailsAsync,
+            _option_template(ticker, expiry, "SMART", currency),
+        )
+        listings = {}
+        for d in details or ():
+            c = d.contract
+            listings.setdefault((float(c.strike), c.right), []).append(c)
+        # One strike/right can be listed more than once (SPX and SPXW on the
+        # third Friday, adjusted deliverables such as "AAPL1"). Keep the
+        # standard listing when exactly one exists; otherwise store None so
+        # callers qualify explicitly and TWS reports the ambiguity.
+        by_strike = {}
+        for k, cands in listings.items():
+            if len(cands) > 1:
+                cands = [
+                    c
+                    for c in cands
+                    if c.tradingClass == ticker and c.multiplier in ("", "100")
+                ]
+            by_strike[k] = cands[0] if len(cands) == 1 else None
+        if by_strike:
+            self._chain_details_cache[key] = (time.monotonic(), by_strike)
+        return by_strike
+
+    async def _qualify_option(self, ticker, expiry, strike, right, currency="USD"):
+        """Qualify an option, tolerating a wrong right or a float/int strike.
+
+        The expiry's contract details are probed once and the requested right,
+        then the opposite right, are looked up locally (float and integer
+        strikes hash alike, so both spellings match); a strike and right
+        listed under several contracts is qualified explicitly.  If the probe
+        returns nothing, the requested contract, the opposite right and the
+        integer strike are qualified concurrently instead.  Exact matches are stored
+        in the shared contract cache; opposite-right substitutes are not, so
+        callers asking for that exact contract never get the wrong right.
+        """
+        # Parse the (possibly LLM-supplied string) strike once for every branch
+        strike = float(strike)
+        key = (ticker, "OPT", "SMART", currency, expiry, strike, right)
+        cached = self._qual_cache.get(key)
+        if cached is not None:
+            return cached
+
+        alt_right = "P" if right == "C" else "C"
+        by_strike = await self._chain_details(ticker, expiry, currency)
+        if by_strike:
+            qc = by_strike.get((strike, right))
+            if qc is not None:
+                self._qual_cache[key] = qc
+                return qc
+            if (strike, right) not in by_strike:
+                return by_strike.get((strike, alt_right))
+            # Several listings share this strike/right: only an explicit
+            # qualification may resolve it (or fail it as ambiguous).
+            qc = await self._qualify_one(
+                _option(ticker, expiry, strike, right, "SMART", currency)
+            )
+            if qc is not None:
+                self._qual_cache[key] = qc
+            return qc
+
+        # Build the contract once; the fallbacks are shallow copies with the
+        # right / strike swapped, which skips Option.__init__ entirely.  They
+        # can't share one mutated object because they are qualified together.
+        primary = _option(ticker, expiry, strike, right, "SMART", currency)
+        alt = copy.copy(primary)
+        alt.right = alt_right
+        candidates = [primary, alt]
+        if strike.is_integer():
+            whole = copy.copy(primary)
+            whole.strike = int(strike)
+            candidates.append(whole)
+        results = await asyncio.gather(
+            *(self._qualify_one(c) for c in candidates), return_exceptions=True
+        )
+        for qc in results:
+            if qc is not None and not isinstance(qc, BaseException):
+                if qc.right == right:
+                    self._qual_cache[key] = qc
+                return qc
+        return None
 
     def connect(self, host="127.0.0.1", port=7496, clientId=1, timeout=15):
         """Connect to TWS or IB Gateway.
 
         If already connected, disconnect first to avoid stale state.
+        The whole handshake (TCP connect, API handshake and initial sync) is
+        bounded by ``timeout`` seconds of wall-clock time.
         """
-        self._ensure_loop()
-
         # Always disconnect cleanly first to avoid Error 326 (clientId in use)
         if self.ib.isConnected():
-            self.ib.disconnect()
+            self._call(self.ib.disconnect)
             self.connected = False
+        # Qualified contracts survive reconnects: conIds are permanent, and
+        # expiry listings are bounded by _CHAIN_DETAILS_TTL anyway.
+        self._chain_cache.clear()
 
         try:
-            self.ib.connect(host, port, clientId=clientId, timeout=timeout)
+            self._run(
+                asyncio.wait_for(
+                    self.ib.connectAsync(
+                        host, port, clientId=clientId, timeout=timeout
+                    ),
+                    timeout,
+                )
+            )
             self.connected = True
-            # After connecting, update the saved loop to the one IB is now using.
-            self._loop = asyncio.get_event_loop()
-            print(f"Connected to IBKR ({host}:{port})")
+            logger.info("Connected to IBKR (%s:%s)", host, port)
             # Patch the internal EWrapper.error to suppress Error 10091.
             # This error ("market data requires additional subscription") is purely
             # informational — TWS still delivers delayed data. Without this patch
             # ib_async prints the raw error string directly via its EClient loop,
             # bypassing Python logging entirely.
             self._patch_wrapper_error()
-        except TimeoutError:
+            self._set_nodelay()
+        except (TimeoutError, asyncio.TimeoutError):
             self.connected = False
             raise ConnectionError(
                 f"Connection timed out after {timeout}s. "
@@ -175,34 +694,55 @@ class IBKRConnector:
             self.connected = False
             raise ConnectionError(f"Connection failed: {e}")
 
+    def _set_nodelay(self):
+        """Disable Nagle's algorithm on the TWS socket.
+
+        The API traffic is many tiny request/response messages, which Nagle
+        can hold back waiting for an ACK.  Recent asyncio versions already set
+        this on TCP transports; setting it explicitly keeps it guaranteed.
+        """
+        try:
+            transport = self.ib.client.conn.transport
+            sock = transport.get_extra_info("socket") if transport else None
+            if sock is not None:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (AttributeError, OSError) as e:
+            logger.debug("Could not set TCP_NODELAY: %s", e)
+
     def disconnect(self):
-        """Disconnect cleanly. Safe to call multiple times."""
+        """Disconnect cleanly. Safe to call multiple times.
+
+        The app shares one connector across all browser sessions, so this
+        drops the IBKR connection for every session, not just the caller's.
+        """
         if self.ib.isConnected():
-            self.ib.disconnect()
+            self._call(self.ib.disconnect)
         self.connected = False
+        self._chain_cache.clear()
 
     def is_ready(self):
-        """Check if connection is alive and sync our state flag.
+        """Check if the connection is alive.
 
-        Also re-attaches the event loop so subsequent calls work.
+        The flag is kept current by connectedEvent / disconnectedEvent, so a
+        dropped socket is noticed without probing the connection here.
         """
-        self._ensure_loop()
-        alive = self.ib.isConnected()
-        if not alive:
-            self.connected = False
-        return alive
+        return self.connected
 
-    def get_option_chain(self, ticker, progress_callback=None):
+    def get_option_chain(self, ticker, progress_callback=None, return_arrays=False):
         """Get all available expirations and strikes for a ticker.
 
         Args:
             ticker: Stock symbol (e.g. 'AAPL').
             progress_callback: Optional callable(str) for progress updates.
+            return_arrays: If True, return an ordered pd.CategoricalIndex of
+                expirations and a float64 np.ndarray of strikes instead of
+                lists, so callers can filter vectorised (e.g.
+                np.searchsorted(strikes, user_strike) in O(log N)).
 
         Returns:
             Tuple of (sorted_expirations, sorted_strikes).
         """
-        if not self.is_ready():
+        if not self.connected:
             raise ConnectionError("Not connected to IBKR.")
 
         def _p(msg):
@@ -211,34 +751,62 @@ class IBKRConnector:
 
         # 1. Qualify the stock contract
         _p(f"📡 Qualifying {ticker}...")
-        stock = Stock(ticker, "SMART", "USD")
-        qualified = self.ib.qualifyContracts(stock)
-        if not qualified:
+        stock = self._qualify_stock(ticker)
+        if stock is None:
             raise ValueError(f"Could not qualify stock: {ticker}")
         _p(f"✅ Qualified: conId={stock.conId}")
 
         # 2. Request option chain definitions
         _p("📥 Requesting option chain from IBKR...")
-        chains = self.ib.reqSecDefOptParams(
-            stock.symbol, "", stock.secType, stock.conId
-        )
+        # Chain definitions change at most daily, so reuse them across reruns
+        hit = self._chain_cache.get(ticker)
+        if hit is not None and time.monotonic() - hit[0] < self._CHAIN_TTL:
+            chains = hit[1]
+        else:
+            chains = self._run(
+                self._throttled(
+                    self.ib.reqSecDefOptParamsAsync,
+                    stock.symbol,
+                    "",
+                    stock.secType,
+                    stock.conId,
+                )
+            )
+            if chains:
+                self._chain_cache[ticker] = (time.monotonic(), chains)
         if not chains:
             raise ValueError(f"No option chains found for {ticker}")
 
         # 3. Aggregate expirations & strikes across all exchanges
-        all_exps = set()
-        all_strikes = set()
-        exchanges = []
-        for chain in chains:
-            exchanges.append(chain.exchange)
-            all_exps.update(chain.expirations)
-            all_strikes.update(chain.strikes)
+        exchanges = [chain.exchange for chain in chains]
+        if return_arrays:
+            # np.unique dedups and sorts in C and hands back arrays directly
+            all_exps = np.unique(
+                np.concatenate([np.asarray(c.expirations, dtype=str) for c in chains])
+            )
+            all_strikes = np.unique(
+                np.concatenate(
+                    [np.asarray(c.strikes, dtype=np.float64) for c in chains]
+                )
+            )
+        else:
+            # Each chain is (almost always) sorted already, so sorting it is a
+            # linear pass and a k-way merge replaces the union + global sort;
+            # groupby drops the adjacent repeats in C.
+            all_exps = [
+                k for k, _ in groupby(merge(*(sorted(c.expirations) for c in chains)))
+            ]
+            all_strikes = [
+                k for k, _ in groupby(merge(*(sorted(c.strikes) for c in chains)))
+            ]
 
         _p(
             f"✅ {len(all_exps)} expirations, {len(all_strikes)} strikes "
             f"on {', '.join(exchanges)}"
         )
-        return sorted(all_exps), sorted(all_strikes)
+        if return_arrays:
+            return pd.CategoricalIndex(all_exps, ordered=True), all_strikes
+        return all_exps, all_strikes
 
     def get_strikes_for_expiration(self, ticker, expiry, currency="USD"):
         """Get the specific strikes available for a given expiration date.
@@ -246,24 +814,17 @@ class IBKRConnector:
         This prevents passing incorrect half-point strikes (from weeklies)
         to LEAPS which only have whole number strikes.
         """
-        if not self.is_ready():
+        if not self.connected:
             raise ConnectionError("Not connected to IBKR.")
 
-        self._ensure_loop()
-
-        # We use an empty strike and an empty right to fetch all options for this expiry
-        contract = Option(ticker, expiry, exchange="SMART", currency=currency)
         try:
-            details = self.ib.reqContractDetails(contract)
-            if not details:
-                return []
-
+            # Uses an empty strike and right to fetch all options for this expiry
+            by_strike = self._run(self._chain_details(ticker, expiry, currency))
             # Extract just the strikes and return a sorted unique list
-            strikes = sorted(list(set(d.contract.strike for d in details)))
-            return strikes
+            return sorted({strike for strike, _ in by_strike})
         except Exception as e:
-            print(
-                f"[ERROR] Failed to fetch specific strikes for {ticker} {expiry}: {e}"
+            logger.error(
+                "Failed to fetch specific strikes for %s %s: %s", ticker, expiry, e
             )
             return []
 
@@ -283,17 +844,142 @@ class IBKRConnector:
 
         For options, pass expiry, strike, right via kwargs.
         """
-        if not self.is_ready():
+        bars = self._fetch_bars(
+            ticker,
+            sec_type,
+            exchange,
+            currency,
+            duration,
+            bar_size_setting,
+            what_to_show,
+            use_rth,
+            **kwargs,
+        )
+        df = _bars_to_df(bars)
+        # Drop the BarData list now rather than at return, so it and the
+        # frame aren't both resident while the caller carries on.
+        n_bars = len(bars) if bars else 0
+        del bars
+        _collect_if_large(n_bars)
+        return df
+
+    def get_historical_arrow(
+        self,
+        ticker,
+        sec_type="STK",
+        exchange="SMART",
+        currency="USD",
+        duration="1 D",
+        bar_size_setting="1 hour",
+        what_to_show="TRADES",
+        use_rth=True,
+        **kwargs,
+    ):
+        """Retrieve historical bar data as a pyarrow.Table.
+
+        Same arguments as get_historical_data.  The table is built straight
+        from the bar fields with no pandas block consolidation; callers that
+        still want pandas can use ``table.to_pandas(types_mapper=pd.ArrowDtype)``.
+        Requires pyarrow (installed with streamlit).
+        """
+        bars = self._fetch_bars(
+            ticker,
+            sec_type,
+            exchange,
+            currency,
+            duration,
+            bar_size_setting,
+            what_to_show,
+            use_rth,
+            **kwargs,
+        )
+        table = _bars_to_arrow(bars)
+        n_bars = len(bars) if bars else 0
+        del bars
+        _collect_if_large(n_bars)
+        return table
+
+    def subscribe_bars(
+        self,
+        ticker,
+        sec_type="STK",
+        exchange="SMART",
+        currency="USD",
+        duration="1 D",
+        bar_size_setting="1 min",
+        what_to_show="TRADES",
+        use_rth=True,
+        **kwargs,
+    ):
+        """Subscribe to a bar series that TWS keeps up to date.
+
+        Instead of re-requesting the whole window on every refresh, the
+        initial bars are fetched once with keepUpToDate=True and TWS streams
+        updates to the last bar (and new bars) over the socket.  Same
+        arguments as get_historical_data.
+
+        Returns:
+            (bars, updates): the live BarDataList (read ``bars[-1]`` on a
+            rerun) and a thread-safe queue.Queue that receives the latest bar
+            on every update, for non-blocking ``get_nowait()`` polling from
+            the Streamlit thread.  Pass ``bars`` to unsubscribe_bars when done.
+        """
+        bars = self._fetch_bars(
+            ticker,
+            sec_type,
+            exchange,
+            currency,
+            duration,
+            bar_size_setting,
+            what_to_show,
+            use_rth,
+            keep_up_to_date=True,
+            **kwargs,
+        )
+        # updateEvent fires on the IB loop thread, so hand bars over through a
+        # thread-safe queue rather than an asyncio.Queue bound to that loop.
+        updates = queue.Queue()
+
+        def _on_update(bar_list, has_new_bar):
+            if bar_list:
+                updates.put_nowait(bar_list[-1])
+
+        # The event is emitted on the loop thread, so attach there too
+        self._call(bars.updateEvent.connect, _on_update)
+        self._bar_handlers[id(bars)] = _on_update
+        return bars, updates
+
+    def unsubscribe_bars(self, bars):
+        """Stop the keepUpToDate stream started by subscribe_bars."""
+        if self.ib.isConnected():
+            self._call(self.ib.cancelHistoricalData, bars)
+        handler = self._bar_handlers.pop(id(bars), None)
+        if handler is not None:
+            self._call(bars.updateEvent.disconnect, handler)
+
+    def _fetch_bars(
+        self,
+        ticker,
+        sec_type,
+        exchange,
+        currency,
+        duration,
+        bar_size_setting,
+        what_to_show,
+        use_rth,
+        keep_up_to_date=False,
+        **kwargs,
+    ):
+        """Qualify the contract and return its raw BarData list."""
+        if not self.connected:
             raise ConnectionError("Not connected to IBKR.")
 
         if sec_type == "STK":
-            contract = Stock(ticker, exchange, currency)
-            qualified = self.ib.qualifyContracts(contract)
-            if not qualified:
+            contract = self._qualify_stock(ticker, exchange, currency)
+            if contract is None:
                 raise ValueError(
                     f"Could not qualify stock: {ticker}. Check the symbol."
                 )
-            contract = qualified[0]
         elif sec_type == "OPT":
             right = kwargs.get("right")
             expiry = kwargs.get("expiry")
@@ -301,15 +987,13 @@ class IBKRConnector:
             if not (right and expiry and strike):
                 raise ValueError("Options require 'right', 'expiry', and 'strike'.")
 
-            contract = Option(
-                ticker, expiry, float(strike), right, exchange, currency=currency
+            contract = self._qualify(
+                _option(ticker, expiry, strike, right, exchange, currency)
             )
-            qualified = self.ib.qualifyContracts(contract)
-            if not qualified:
+            if contract is None:
                 raise ValueError(
                     f"Could not qualify option: {ticker} {expiry} {strike} {right}"
                 )
-            contract = qualified[0]
 
             # Options often lack TRADES data; default to MIDPOINT
             if what_to_show == "TRADES":
@@ -317,19 +1001,181 @@ class IBKRConnector:
         else:
             raise ValueError(f"Unsupported security type: {sec_type}")
 
-        bars = self.ib.reqHistoricalData(
-            contract,
-            endDateTime="",
-            durationStr=duration,
-            barSizeSetting=bar_size_setting,
-            whatToShow=what_to_show,
-            useRTH=use_rth,
-            formatDate=1,
+        return self._run(
+            self._throttled(
+                self.ib.reqHistoricalDataAsync,
+                contract,
+                endDateTime="",
+                durationStr=duration,
+                barSizeSetting=bar_size_setting,
+                whatToShow=what_to_show,
+                useRTH=use_rth,
+                formatDate=1,
+                keepUpToDate=keep_up_to_date,
+            )
         )
 
-        df = util.df(bars)
-        if df is not None and not df.empty:
-            df.set_index("date", inplace=True)
+    async def _build_contract(self, spec, exchange="SMART", currency="USD"):
+        """Qualify a historical-data spec into a contract (or None).
+
+        A spec is either a stock symbol ("AAPL") or an option tuple
+        (ticker, expiry, strike, right).  Both go through the connector's
+        qualification caches.  Unlike order legs, an option spec must match
+        exactly: _qualify_option's opposite-right substitute counts as
+        unqualified, so PUT bars are never returned under a CALL spec.
+        """
+        if isinstance(spec, str):
+            return await self._qualify_stock_async(spec, exchange, currency)
+        ticker, expiry, strike, right = spec
+        qc = await self._qualify_option(ticker, expiry, strike, right, currency)
+        if qc is None or qc.right != right:
+            return None
+        return qc
+
+    def get_historical_data_many(
+        self,
+        specs,
+        exchange="SMART",
+        currency="USD",
+        duration="1 D",
+        bar_size_setting="1 hour",
+        what_to_show="TRADES",
+        use_rth=True,
+    ):
+        """Retrieve historical bars for several contracts concurrently.
+
+        Args:
+            specs: Iterable of stock symbols ("AAPL") and/or option tuples
+                (ticker, expiry, strike, right).  Options default to MIDPOINT
+                when what_to_show is "TRADES", as in get_historical_data.
+                A spec may also be a dict with "ticker" (plus "expiry",
+                "strike" and "right" for options) and any of duration,
+                bar_size_setting, what_to_show and use_rth overriding the
+                shared defaults for that request only; its result is keyed
+                by the equivalent symbol or option tuple.
+
+        IBKR allows at most 50 simultaneous historical data requests, so at
+        most 45 are kept in flight at once (shared across the connector via
+        self._hist_sem) to leave headroom for other callers.
+
+        Returns:
+            Dict of {spec: DataFrame}; the value is None when the contract
+            could not be qualified, its request failed or returned no bars.
+            Dict specs missing a required key are logged and left out.
+        """
+        if not self.connected:
+            raise ConnectionError("Not connected to IBKR.")
+
+        # Normalize dict specs up front: a malformed one is dropped here
+        # instead of failing the whole gather below.
+        requests = []
+        for spec in specs:
+            opts = {}
+            if isinstance(spec, dict):
+                opts = spec
+                try:
+                    spec = opts["ticker"]
+                    if opts.get("expiry"):
+                        spec = (spec, opts["expiry"], opts["strike"], opts["right"])
+                except KeyError as e:
+                    logger.warning("Skipping historical data spec %s: missing %s", opts, e)
+                    continue
+            requests.append((spec, opts))
+
+        async def _one(spec, opts):
+            async with self._hist_sem:
+                try:
+                    contract = await self._build_contract(spec, exchange, currency)
+                except Exception as e:
+                    logger.warning("Could not qualify contract %s: %s", spec, e)
+                    return spec, None
+                if contract is None:
+                    logger.warning("Could not qualify contract: %s", spec)
+                    return spec, None
+                show = opts.get("what_to_show", what_to_show)
+                if contract.secType == "OPT" and show == "TRADES":
+                    show = "MIDPOINT"
+                try:
+                    bars = await self._throttled(
+                        self.ib.reqHistoricalDataAsync,
+                        contract,
+                        endDateTime="",
+                        durationStr=opts.get("duration", duration),
+                        barSizeSetting=opts.get("bar_size_setting", bar_size_setting),
+                        whatToShow=show,
+                        useRTH=opts.get("use_rth", use_rth),
+                        formatDate=1,
+                    )
+                except Exception as e:
+                    logger.warning("Historical data request failed for %s: %s", spec, e)
+                    return spec, None
+                return spec, _bars_to_df(bars)
+
+        return dict(self._gather(*(_one(s, o) for s, o in requests)))
+
+    def get_historical_data_chunked(
+        self,
+        spec,
+        n_chunks,
+        chunk_days=1,
+        exchange="SMART",
+        currency="USD",
+        bar_size_setting="1 min",
+        what_to_show="TRADES",
+        use_rth=True,
+    ):
+        """Retrieve a long bar history as consecutive windows fetched concurrently.
+
+        IBKR caps how many bars one request may return (e.g. about a day of
+        1-min bars), so long histories need several requests.  The n_chunks
+        windows of chunk_days each, ending now, are requested in parallel;
+        their bars are joined into one list (overlapping bars at window edges
+        are dropped) and a single DataFrame is built at the end, rather than
+        concatenating one frame per window.
+
+        Args:
+            spec: Stock symbol or (ticker, expiry, strike, right) tuple, as in
+                get_historical_data_many.
+
+        Returns:
+            Date-indexed DataFrame, or None if nothing came back.
+        """
+        if not self.connected:
+            raise ConnectionError("Not connected to IBKR.")
+
+        contract = self._run(self._build_contract(spec, exchange, currency))
+        if contract is None:
+            raise ValueError(f"Could not qualify contract: {spec}")
+        if contract.secType == "OPT" and what_to_show == "TRADES":
+            what_to_show = "MIDPOINT"
+
+        now = datetime.now(timezone.utc)
+
+        async def _window(i):
+            async with self._hist_sem:
+                return await self._throttled(
+                    self.ib.reqHistoricalDataAsync,
+                    contract,
+                    endDateTime=now - timedelta(days=i * chunk_days),
+                    durationStr=f"{chunk_days} D",
+                    barSizeSetting=bar_size_setting,
+                    whatToShow=what_to_show,
+                    useRTH=use_rth,
+                    formatDate=1,
+                )
+
+        # Oldest window first, so the joined list is already in date order
+        windows = self._gather(*(_window(i) for i in reversed(range(n_chunks))))
+        bars = []
+        for window in windows:
+            for b in window or ():
+                if not bars or b.date > bars[-1].date:
+                    bars.append(b)
+        del windows
+        df = _bars_to_df(bars)
+        n_bars = len(bars)
+        del bars
+        _collect_if_large(n_bars)
         return df
 
     def get_implied_volatility(
@@ -346,131 +1192,120 @@ class IBKRConnector:
         Otherwise fetches the 30-day index IV (OPTION_IMPLIED_VOLATILITY) for the stock.
         Returns the IV value as a decimal (e.g. 1.06 for 106%), or None if unavailable.
         """
-        if not self.is_ready():
+        if not self.connected:
             return None
 
         if expiry and strike:
             try:
                 # Options are best qualified with an empty exchange "" rather than "SMART" to avoid Error 200
-                contract = Option(
-                    ticker, expiry, float(strike), right, "SMART", "", currency
+                contract = self._run(
+                    self._qualify_option(ticker, expiry, strike, right, currency)
                 )
-                qualified = self.ib.qualifyContracts(contract)
 
-                # If it fails, try the opposite right just strictly to get the IV of the strike
-                if not qualified:
-                    alt_right = "P" if right == "C" else "C"
-                    alt_contract = Option(
-                        ticker,
-                        expiry,
-                        float(strike),
-                        alt_right,
-                        "SMART",
-                        "",
-                        currency,
-                    )
-                    qualified = self.ib.qualifyContracts(alt_contract)
-
-                # If it still fails, try strict integer strike if it's a whole number
-                if not qualified and float(strike).is_integer():
-                    int_strike = int(float(strike))
-                    int_contract = Option(
-                        ticker,
-                        expiry,
-                        int_strike,
-                        right,
-                        "SMART",
-                        "",
-                        currency,
+                if contract is not None:
+                    self._call(self.ib.reqMarketDataType, 3)
+
+                    # Try a one-shot snapshot first: it ends itself, so there is
+                    # no subscription to cancel. Generic ticks can't be combined
+                    # with snapshot=True (Error 321), so read the model IV that
+                    # comes with the default option ticks instead of tick 106.
+                    snap, got_iv = self._run(
+                        self._req_mkt_data(
+                            contract,
+                            "",
+                            _has_model_iv,
+                            timeout=1.5,
+                            snapshot=True,
+                        )
                     )
-                    qualified = self.ib.qualifyContracts(int_contract)
-
-                if qualified:
-                    contract = qualified[0]
-                    self.ib.reqMarketDataType(3)
-
-                    # Request tick data for implied volatility (106)
-                    ticker_data = self.ib.reqMktData(
-                        contract, "106", snapshot=False, regulatorySnapshot=False
+                    if got_iv:
+                        iv = snap.modelGreeks.impliedVol
+                        logger.info(
+                            "📊 Native IBKR Option IV fetched for %s %s%s: %s",
+                            expiry,
+                            strike,
+                            right,
+                            iv,
+                        )
+                        return {"iv": float(iv), "hv": None, "avg": float(iv)}
+
+                    # Delayed data can't always be snapshotted; fall back to
+                    # streaming tick data for implied volatility (106)
+                    # Wait up to 3 seconds, returning as soon as the IV tick lands
+                    ticker_data, got_iv = self._run(
+                        self._req_mkt_data(
+                            contract,
+                            "106",
+                            lambda t: _valid(t.impliedVolatility),
+                            timeout=3.0,
+                            clear=("impliedVolatility",),
+                        )
                     )
-
-                    # Clear stale cached values to force waiting for fresh data
-                    ticker_data.impliedVolatility = float("nan")
-
-                    for _ in range(30):
-                        self.ib.sleep(0.1)
+                    if got_iv:
                         iv = ticker_data.impliedVolatility
-                        if iv == iv and iv != 0.0:
-                            self.ib.cancelMktData(contract)
-                            print(
-                                f"📊 Native IBKR Option IV fetched for {expiry} {strike}{right}: {iv}"
-                            )
-                            return {"iv": float(iv), "hv": None, "avg": float(iv)}
-
-                    self.ib.cancelMktData(contract)
+                        logger.info(
+                            "📊 Native IBKR Option IV fetched for %s %s%s: %s",
+                            expiry,
+                            strike,
+                            right,
+                            iv,
+                        )
+                        return {"iv": float(iv), "hv": None, "avg": float(iv)}
             except Exception as e:
-                print(
-                    f"Failed to fetch option specific IV for {ticker} {expiry} {strike}: {e}"
+                logger.warning(
+                    "Failed to fetch option specific IV for %s %s %s: %s",
+                    ticker,
+                    expiry,
+                    strike,
+                    e,
                 )
 
         # Fallback to Stock 30-day IV index (Average of Tick type 104 and 106)
         try:
-            contract = Stock(ticker, exchange, currency)
-            qualified = self.ib.qualifyContracts(contract)
-            if qualified:
-                contract = qualified[0]
-                self.ib.reqMarketDataType(3)
+            contract = self._qualify_stock(ticker, exchange, currency)
+            if contract is not None:
+                self._call(self.ib.reqMarketDataType, 3)
 
                 # Request tick data including implied volatility (106) and historical volatility (104)
                 # TWS typically displays the average of these two for its main IV figure
-                ticker_data = self.ib.reqMktData(
-                    contract, "104,106", snapshot=False, regulatorySnapshot=False
+                # Wait up to 3 seconds for both volatilities to populate
+                ticker_data, _ = self._run(
+                    self._req_mkt_data(
+                        contract,
+                        "104,106",
+                        lambda t: _valid(t.impliedVolatility)
+                        and _valid(t.histVolatility),
+                        timeout=3.0,
+                        clear=("impliedVolatility", "histVolatility"),
+                    )
                 )
 
-                # Clear stale cached values to force waiting for fresh data
-                ticker_data.impliedVolatility = float("nan")
-                ticker_data.histVolatility = float("nan")
-
-                # Wait up to 3 seconds for volatilities to populate
-                for _ in range(30):
-                    self.ib.sleep(0.1)
-                    iv = ticker_data.impliedVolatility
-                    hv = ticker_data.histVolatility
-
-                    iv_valid = iv == iv and iv != 0.0
-                    hv_valid = hv == hv and hv != 0.0
-
-                    if iv_valid and hv_valid:
-                        self.ib.cancelMktData(contract)
-                        avg_iv = float((iv + hv) / 2.0)
-                        print(f"📊 Native IBKR IV fetched (106): {iv}")
-                        print(f"📈 Native IBKR HV fetched (104): {hv}")
-                        print(f"⚖️ Calculated Average: {avg_iv}")
-                        return {"iv": float(iv), "hv": float(hv), "avg": avg_iv}
-
-                # If we exhausted the loop, use whatever is available
+                # On timeout, use whatever is available
                 iv = ticker_data.impliedVolatility
                 hv = ticker_data.histVolatility
-                iv_valid = iv == iv and iv != 0.0
-                hv_valid = hv == hv and hv != 0.0
-
-                self.ib.cancelMktData(contract)
+                iv_valid = _valid(iv)
+                hv_valid = _valid(hv)
 
                 if iv_valid and hv_valid:
                     avg_iv = float((iv + hv) / 2.0)
-                    print(f"📊 Native IBKR IV fetched (106): {iv}")
-                    print(f"📈 Native IBKR HV fetched (104): {hv}")
-                    print(f"⚖️ Calculated Average: {avg_iv}")
+                    logger.info(
+                        "📊 Native IBKR IV fetched (106): %s, HV (104): %s, average: %s",
+                        iv,
+                        hv,
+                        avg_iv,
+                    )
                     return {"iv": float(iv), "hv": float(hv), "avg": avg_iv}
                 elif iv_valid:
-                    print(f"📊 Native IBKR IV fetched (106): {iv}")
+                    logger.info("📊 Native IBKR IV fetched (106): %s", iv)
                     return {"iv": float(iv), "hv": None, "avg": float(iv)}
                 elif hv_valid:
-                    print(f"📈 Native IBKR HV fetched (104): {hv}")
+                    logger.info("📈 Native IBKR HV fetched (104): %s", hv)
                     return {"iv": None, "hv": float(hv), "avg": float(hv)}
 
         except Exception as e:
-            print(f"Failed to fetch stock live implied volatility for {ticker}: {e}")
+            logger.warning(
+                "Failed to fetch stock live implied volatility for %s: %s", ticker, e
+            )
 
         # Final Fallback to Historical 30-day IV index
         try:
@@ -486,11 +1321,13 @@ class IBKRConnector:
             )
             if df is not None and not df.empty and "close" in df.columns:
                 iv_close = float(df["close"].iloc[-1])
-                print(f"📊 Native IBKR Historical IV fetched: {iv_close}")
+                logger.info("📊 Native IBKR Historical IV fetched: %s", iv_close)
                 return {"iv": iv_close, "hv": None, "avg": iv_close}
         except Exception as e:
-            print(
-                f"Failed to fetch stock historical implied volatility for {ticker}: {e}"
+            logger.warning(
+                "Failed to fetch stock historical implied volatility for %s: %s",
+                ticker,
+                e,
             )
         return {"iv": None, "hv": None, "avg": None}
 
@@ -511,104 +1348,71 @@ class IBKRConnector:
         Returns:
             dict: Contains 'status' (success/error), 'msg' (details), and 'order_id' if successful.
         """
-        if not self.is_ready():
+        if not self.connected:
             return {"status": "error", "msg": "Not connected to IBKR."}
 
-        self._ensure_loop()
-
         if not legs:
             return {"status": "error", "msg": "No legs provided for the strategy."}
 
         try:
-            # 1. Qualify all individual option contracts to get their conIds
-            qualified_legs = []
-            for leg in legs:
-                opt = Option(
-                    ticker,
-                    leg["expiry"],
-                    float(leg["strike"]),
-                    leg["right"],
-                    "SMART",
-                    "",
-                    "USD",
-                )
-                qualified = self.ib.qualifyContracts(opt)
-
-                # If it fails, try the opposite right (not strictly needed for orders, but useful to catch weird data issues)
-                if not qualified:
-                    alt_right = "P" if leg["right"] == "C" else "C"
-                    alt_contract = Option(
-                        ticker,
-                        leg["expiry"],
-                        float(leg["strike"]),
-                        alt_right,
-                        "SMART",
-                        "",
-                        "USD",
-                    )
-                    qualified = self.ib.qualifyContracts(alt_contract)
-                    if qualified:
-                        # If the alternate right qualified, it means the LLM guessed the WRONG right for that strike (e.g. only puts exist)
-                        # We must update the leg action to match reality, otherwise the order will fail
-                        leg["right"] = alt_right
-                        print(
-                            f"⚠️ Corrected leg right to {alt_right} to match available IBKR chain."
-                        )
-
-                # If it still fails, try strict integer strike if it's a whole number
-                if not qualified and float(leg["strike"]).is_integer():
-                    int_strike = int(float(leg["strike"]))
-                    int_contract = Option(
-                        ticker,
-                        leg["expiry"],
-                        int_strike,
-                        leg["right"],
-                        "SMART",
-                        "",
-                        "USD",
+            # 1. Qualify all individual option contracts to get their conIds.
+            # Legs are qualified concurrently (each with its own concurrent
+            # opposite-right / integer-strike fallbacks), so an N-leg combo
+            # costs about one TWS round-trip.
+            qualified = self._gather(
+                *(
+                    self._qualify_option(
+                        ticker, leg["expiry"], leg["strike"], leg["right"]
                     )
-                    qualified = self.ib.qualifyContracts(int_contract)
-
-                if not qualified:
-                    return {"status": "error", "msg": f"Could not qualify leg: {opt}"}
+                    for leg in legs
+                )
+            )
 
-                # Store the qualified contract alongside the requested action/qty
-                qualified_legs.append(
-                    {
-                        "contract": qualified[0],
-                        "action": leg["action"],
-                        "quantity": leg.get("quantity", 1),
+            # Validate and record each leg in one pass, storing the qualified
+            # contract alongside the requested action/qty
+            leg_specs = [None] * len(legs)
+            for i, (leg, qc) in enumerate(zip(legs, qualified)):
+                right = leg["right"]
+                if qc is None:
+                    return {
+                        "status": "error",
+                        "msg": f"Could not qualify leg: {ticker} {leg['expiry']} "
+                        f"{leg['strike']}{right}",
                     }
-                )
+                if qc.right != right:
+                    # If the alternate right qualified, it means the LLM guessed the WRONG right for that strike (e.g. only puts exist)
+                    # We must update the leg action to match reality, otherwise the order will fail
+                    leg["right"] = qc.right
+                    logger.warning(
+                        "⚠️ Corrected leg right to %s to match available IBKR chain.",
+                        qc.right,
+                    )
+                leg_specs[i] = _LegSpec(qc, leg["action"], int(leg.get("quantity", 1)))
 
             # 2. Build the contract (Single Option vs BAG/Combo)
-            if len(qualified_legs) == 1:
+            if len(leg_specs) == 1:
                 # Single leg order
-                main_contract = qualified_legs[0]["contract"]
-                ib_action = qualified_legs[0]["action"]
-                quantity = int(qualified_legs[0]["quantity"]) * total_quantity
+                main_contract = leg_specs[0].contract
+                ib_action = leg_specs[0].action
+                quantity = leg_specs[0].ratio * total_quantity
             else:
                 # Multi-leg Combo order (BAG)
                 main_contract = Contract(
                     symbol=ticker, secType="BAG", exchange="SMART", currency="USD"
                 )
 
-                combo_legs = []
-                for leg_info in qualified_legs:
-                    conId = leg_info["contract"].conId
-                    # For combo legs, action is relative to the combo order action.
-                    # It's generally simpler to just set the combo order action to "BUY"
-                    # and set the leg actions explicitly to what they should be.
-                    leg_action = leg_info["action"]
-                    combo_leg = ComboLeg(
-                        conId=conId,
-                        ratio=int(leg_info["quantity"]),
-                        action=leg_action,
+                # For combo legs, action is relative to the combo order action.
+                # It's generally simpler to just set the combo order action to "BUY"
+                # and set the leg actions explicitly to what they should be.
+                main_contract.comboLegs = [
+                    ComboLeg(
+                        conId=spec.contract.conId,
+                        ratio=spec.ratio,
+                        action=spec.action,
                         exchange="SMART",
                     )
-                    combo_legs.append(combo_leg)
-
-                main_contract.comboLegs = combo_legs
+                    for spec in leg_specs
+                ]
                 ib_action = (
                     "BUY"  # The BAG is "bought", leg actions determine the actual trade
                 )
@@ -631,12 +1435,13 @@ class IBKRConnector:
                 }
 
             # 4. Submit the Order
-            print(f"Submitting {order_type} order for {main_contract}: {order}")
-            trade = self.ib.placeOrder(main_contract, order)
+            logger.info(
+                "Submitting %s order for %s: %s", order_type, main_contract, order
+            )
+            trade = self._call(self.ib.placeOrder, main_contract, order)
 
-            # Wait briefly to let the order status update if possible
-            for _ in range(5):
-                self.ib.sleep(0.1)
+            # Wait up to 500 ms for TWS to report the first status update
+            self._run(self._wait_status(trade, timeout=0.5))
 
             status = trade.orderStatus.status
             if status == "Cancelled" or status == "Inactive":
@@ -657,7 +1462,7 @@ class IBKRConnector:
 
         except Exception as e:
             msg = f"Failed to submit strategy order: {e}"
-            print(f"❌ {msg}")
+            logger.error("❌ %s", msg)
             return {"status": "error", "msg": msg}
 
     def get_real_greeks_table(
@@ -671,147 +1476,165 @@ class IBKRConnector:
         since they are computed independently from the real price.
         Falls back to theoretical Black-Scholes price if Bid/Ask is unavailable.
         """
-        from option_utils import black_scholes_greeks, days_to_expiry
-        import math
+        from option_utils import black_scholes_chain_vec, days_to_expiry, greeks_rows
 
         dte = days_to_expiry(expiry_str)
 
-        # Build pure-theoretical table first as the safe baseline
-        bs_table = {}
-        for s in strikes:
-            bs_table[s] = {
-                "C": black_scholes_greeks(
-                    underlying_price, s, dte, rate, hist_vol, "C"
-                ),
-                "P": black_scholes_greeks(
-                    underlying_price, s, dte, rate, hist_vol, "P"
-                ),
-            }
+        # Build pure-theoretical rows first as the safe baseline: one
+        # vectorized pass over all strikes for both rights, split into one
+        # greeks dict per strike (lists aligned with strikes).
+        bs = black_scholes_chain_vec(underlying_price, strikes, dte, rate, hist_vol)
+        calls = greeks_rows(bs["C"])
+        puts = greeks_rows(bs["P"])
 
-        if not self.is_ready() or not strikes:
-            results = []
-            for s in strikes:
-                results.append(
-                    {
-                        "strike": s,
-                        "expiry": expiry_str,
-                        "dte": dte,
-                        "call": bs_table[s]["C"],
-                        "put": bs_table[s]["P"],
-                    }
-                )
-            return results
+        def _assemble():
+            return [
+                {"strike": s, "expiry": expiry_str, "dte": dte, "call": c, "put": p}
+                for s, c, p in zip(strikes, calls, puts)
+            ]
 
-        self._ensure_loop()
+        if not self.connected or not strikes:
+            return _assemble()
 
         # Set delayed market data (type 3) to avoid real-time subscription requirement
-        self.ib.reqMarketDataType(3)
+        self._call(self.ib.reqMarketDataType, 3)
 
-        # Build and qualify contracts one at a time to handle individual failures gracefully
+        # Resolve the strike x right grid from the expiry's cached contract
+        # details; contracts missing there are qualified individually below,
+        # each one's quote request following as soon as it resolves.
+        grid = [(s, right) for s in strikes for right in ("C", "P")]
+        try:
+            by_strike = self._run(self._chain_details(ticker, expiry_str)) or {}
+        except Exception as e:
+            # Not fatal: every contract is then qualified individually
+            logger.warning(
+                "Contract details probe failed for %s %s: %s", ticker, expiry_str, e
+            )
+            by_strike = {}
         real_prices = {}  # {(strike, right): mid_price}
 
         # --- EARLY EXIT MECHANISM FOR ERROR 10167 (No Market Data) ---
         # If the user has no live data subscription for options, TWS will throw Error 10167.
         # Instead of waiting 20s x (number of strikes) and freezing the UI, we intercept
         # the error once and break out immediately to use theoretical Greeks.
-        self._no_mkt_data = False
-        original_error_handler = self.ib.wrapper.error  # type: ignore[attr-defined]
-
-        def _catch_10167(req_id, error_code, error_string, contract=""):
-            if error_code == 10167:
-                self._no_mkt_data = True
-                print(
-                    f"⚠️ [Fast Fallback] Nessun abbonamento dati (Err 10167) rilevato. Interrompo le chiamate API per le opzioni."
-                )
-            # Still call the original to preserve the standard logging behavior
-            original_error_handler(req_id, error_code, error_string, contract)
+        # The hook runs ahead of the standard logging in _dispatch_error.
+        # The flag is local to this call; the connector is shared by every
+        # session, so nothing per-call is kept on self.  Only errors for the
+        # conIds this call requests trip it, not other sessions' requests.
+        no_mkt_data = False
+        con_ids = set()
+
+        def _catch_10167(req_id, error_code, error_string, contract):
+            nonlocal no_mkt_data
+            req = self.ib.wrapper.reqId2Ticker.get(req_id)
+            if req is None or req.contract.conId not in con_ids:
+                return
+            no_mkt_data = True
+            logger.warning(
+                "⚠️ [Fast Fallback] Nessun abbonamento dati (Err 10167) rilevato. Interrompo le chiamate API per le opzioni."
+            )
 
-        self.ib.wrapper.error = _catch_10167  # type: ignore[method-assign]
+        self._patch_wrapper_error()
+        hooks = self._error_hooks.setdefault(10167, [])
+        hooks.append(_catch_10167)
         # -------------------------------------------------------------
 
-        for s in strikes:
-            if self._no_mkt_data:
-                break  # Stop pinging IBKR entirely for this chain
-
-            for right in ("C", "P"):
-                if self._no_mkt_data:
-                    break
+        async def _quote(s, right):
+            key = (float(s), right)
+            qc = by_strike.get(key)
+            if qc is None:
+                # A failure here only leaves this row on theoretical greeks
                 try:
-                    contract = Option(
-                        ticker, expiry_str, float(s), right, "SMART", "", "USD"
-                    )
-                    qualified = self.ib.qualifyContracts(contract)
-                    if not qualified:
-                        print(
-                            f"[WARN] Could not qualify {ticker} {expiry_str} {s}{right}"
-                        )
-                        continue
-
-                    qc = qualified[0]
-
-                    # Request snapshot WITHOUT generic ticks — Bid/Ask arrive by default
-                    # Using "100" (generic tick) with snapshot=True on delayed option data
-                    # triggers Error 321 ("Invalid tick type for snapshot") on some contracts.
-                    td = self.ib.reqMktData(
-                        qc, "", snapshot=True, regulatorySnapshot=False
-                    )
-
-                    # Wait up to 2 seconds for Bid/Ask to populate
-                    for _ in range(20):
-                        self.ib.sleep(0.1)
-                        bid = td.bid
-                        ask = td.ask
-                        bid_valid = bid is not None and bid == bid and bid > 0
-                        ask_valid = ask is not None and ask == ask and ask > 0
-                        if bid_valid and ask_valid:
-                            real_prices[(float(s), right)] = round((bid + ask) / 2.0, 4)
-                            break
-
-                    self.ib.cancelMktData(qc)
-
+                    qc = await self._qualify_one(_option(ticker, expiry_str, s, right))
                 except Exception as e:
-                    print(
-                        f"[WARN] Bid/Ask fetch failed for {ticker} {expiry_str} {s}{right}: {e}"
+                    logger.warning(
+                        "Could not qualify %s %s %s%s: %s",
+                        ticker,
+                        expiry_str,
+                        s,
+                        right,
+                        e,
                     )
+                    return
+                if qc is None:
+                    logger.warning(
+                        "Could not qualify %s %s %s%s", ticker, expiry_str, s, right
+                    )
+                    return
+            if no_mkt_data:
+                return  # Stop pinging IBKR entirely for this chain
+            con_ids.add(qc.conId)
+            try:
+                # Request snapshot WITHOUT generic ticks — Bid/Ask arrive by default
+                # Using "100" (generic tick) with snapshot=True on delayed option data
+                # triggers Error 321 ("Invalid tick type for snapshot") on some contracts.
+                # Wait up to 2 seconds for Bid/Ask, returning as soon as both land
+                td, got_quote = await self._req_mkt_data(
+                    qc,
+                    "",
+                    lambda t: _positive(t.bid) and _positive(t.ask),
+                    timeout=2.0,
+                    snapshot=True,
+                )
+                if got_quote:
+                    real_prices[key] = _mid_price(td.bid, td.ask)
 
-        # Restore the original error handler so we don't accidentally leak state
-        self.ib.wrapper.error = original_error_handler  # type: ignore[method-assign]
-
-        # Compose results: real Bid/Ask mid-price + local Black-Scholes Greeks
-        results = []
-        for s in strikes:
-            call_dict = bs_table[s]["C"].copy()
-            put_dict = bs_table[s]["P"].copy()
+            except Exception as e:
+                logger.warning(
+                    "Bid/Ask fetch failed for %s %s %s%s: %s",
+                    ticker,
+                    expiry_str,
+                    s,
+                    right,
+                    e,
+                )
 
-            mid_call = real_prices.get((float(s), "C"))
-            mid_put = real_prices.get((float(s), "P"))
+        # All snapshots are in flight together (capped by the market data
+        # line semaphore), so the grid costs about one 2 s wait, not one each;
+        # listed contracts are quoted at once while any stragglers qualify.
+        # On 10167 every pending wait gives up at once (see _await_ticker),
+        # and contracts still qualifying are never requested.
+        try:
+            self._gather(*(_quote(s, right) for s, right in grid))
+        finally:
+            # Drop only this call's hook; other sessions may have their own
+            hooks.remove(_catch_10167)
+
+        # Compose results: real Bid/Ask mid-price + local Black-Scholes Greeks.
+        # The baseline dicts are fresh per call, so prices are set in place.
+        debug = logger.isEnabledFor(logging.DEBUG)
+        for s, call_dict, put_dict in zip(strikes, calls, puts):
+            fs = float(s)
+            mid_call = real_prices.get((fs, "C"))
+            mid_put = real_prices.get((fs, "P"))
 
             if mid_call is not None:
                 call_dict["price"] = mid_call
-                print(
-                    f"✅ Real Bid/Ask price for {ticker} {expiry_str} {s}C: ${mid_call}"
-                )
+                if debug:
+                    logger.debug(
+                        "✅ Real Bid/Ask price for %s %s %sC: $%s",
+                        ticker,
+                        expiry_str,
+                        s,
+                        mid_call,
+                    )
 
             if mid_put is not None:
                 put_dict["price"] = mid_put
-                print(
-                    f"✅ Real Bid/Ask price for {ticker} {expiry_str} {s}P: ${mid_put}"
-                )
-
-            results.append(
-                {
-                    "strike": s,
-                    "expiry": expiry_str,
-                    "dte": dte,
-                    "call": call_dict,
-                    "put": put_dict,
-                }
-            )
+                if debug:
+                    logger.debug(
+                        "✅ Real Bid/Ask price for %s %s %sP: $%s",
+                        ticker,
+                        expiry_str,
+                        s,
+                        mid_put,
+                    )
 
-        return results
+        return _assemble()
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     connector = IBKRConnector()
     try:
         connector.connect()
@@ -1,15 +1,20 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
-import traceback
+import inspect
+import logging
 import os
+import re
 import subprocess
 import shutil
+from datetime import date, datetime
+from functools import wraps
+from itertools import compress
 
 from ibkr_connector import IBKRConnector
 from technical_analysis import add_indicators, detect_patterns, get_holders_info, get_financial_info
 from option_utils import (
-    compute_greeks_table,
     historical_volatility,
     vectorized_black_scholes,
     days_to_expiry,
@@ -38,12 +43,137 @@ except ImportError:
     OpencodeDebate = None
     OpencodeAgent = None
 
+logger = logging.getLogger(__name__)
+
 # Streamlit Config
 st.set_page_config(page_title="IBKR AI Trader", layout="wide")
+# No-op on reruns: basicConfig only configures an unconfigured root logger
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+
+
+@st.cache_resource
+def get_connector() -> IBKRConnector:
+    """Return the process-wide IBKR connector (shared by all sessions)."""
+    # The IB loop thread, socket and contract caches survive reruns and new
+    # browser sessions; a second connector reconnecting with the same
+    # clientId would otherwise hit Error 326.
+    return IBKRConnector()
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def get_yf_greeks_cached(ticker, expiry_str, strikes, underlying_price):
+    """get_option_greeks_from_yfinance(), reused for a minute across reruns."""
+    # strikes is passed as a tuple so the arguments hash the same every rerun
+    return get_option_greeks_from_yfinance(
+        ticker, expiry_str, list(strikes), underlying_price
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_trader_agent(provider_type, model_name):
+    """Return a TraderAgent per (provider, model), built once per process."""
+    # Construction sets up the AI client and loads the knowledge base
+    return TraderAgent(provider_type=provider_type, model_name=model_name)
+
+
+# AIProvider model-list lookups hit the provider APIs; render_streamlit_sidebar()
+# runs them on every rerun, so they are served from st.cache_data instead.
+_MODEL_LIST_TTLS = (
+    ("get_gemini_models", 900),
+    ("get_groq_models", 900),
+    ("get_ollama_models", 60),
+)
+
+
+class _NoModels(Exception):
+    """An empty or fallback model list; raised so st.cache_data does not keep it."""
+
+
+def _cached_model_list(fetch, ttl, fallback):
+    # wraps() keeps fetch's qualname and source, so each lookup gets its own
+    # st.cache_data key.
+    @wraps(fetch)
+    def _checked(*args, **kwargs):
+        models = fetch(*args, **kwargs)
+        # Empty, or the static fallback list: a transient provider/API-key
+        # failure that should be retried on the next rerun, not for the TTL.
+        if not models or (fallback is not None and models == fallback):
+            raise _NoModels(models)
+        return models
+
+    cached = st.cache_data(ttl=ttl, show_spinner=False)(_checked)
+
+    @wraps(fetch)
+    def lookup(*args, **kwargs):
+        try:
+            return cached(*args, **kwargs)
+        except _NoModels as e:
+            return e.args[0]
+
+    lookup.cached_model_list = cached
+    return lookup
+
+
+def _cache_model_lists(provider_cls):
+    """Replace provider_cls's model-list staticmethods with cached versions."""
+    fallback = getattr(provider_cls, "FALLBACK_ORDER", None)
+    for name, ttl in _MODEL_LIST_TTLS:
+        fetch = getattr(provider_cls, name, None)
+        # Missing in this agents version, or already wrapped on an earlier rerun
+        if fetch is None or hasattr(fetch, "cached_model_list"):
+            continue
+        setattr(provider_cls, name, staticmethod(_cached_model_list(fetch, ttl, fallback)))
+
+
+class _NoBars(Exception):
+    """An empty history fetch; raised so st.cache_data does not keep it."""
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _history_with_indicators(
+    _connector, connected, ticker, sec_type, duration, bar_size_setting, **opt_kwargs
+):
+    # _connector is skipped by the cache key; `connected` is part of it so
+    # a yfinance fallback taken while offline is not served once connected.
+    df, src = get_historical_data_with_fallback(
+        _connector,
+        ticker,
+        sec_type=sec_type,
+        duration=duration,
+        bar_size_setting=bar_size_setting,
+        **opt_kwargs,
+    )
+    if df is None or df.empty:
+        raise _NoBars(src)
+    return add_indicators(df), src
+
+
+def get_history_cached(connector, ticker, sec_type, duration, bar_size_setting, **opt_kwargs):
+    """Historical bars with indicators added, reused for 5 minutes across reruns.
+
+    opt_kwargs are the option's expiry, strike and right.  Returns
+    (df, source) like get_historical_data_with_fallback, with df None when
+    nothing came back; empty results are not cached.
+    """
+    try:
+        return _history_with_indicators(
+            connector,
+            connector.connected,
+            ticker,
+            sec_type,
+            duration,
+            bar_size_setting,
+            **opt_kwargs,
+        )
+    except _NoBars as e:
+        return None, e.args[0]
+
 
 # Session State — single connector instance, reused across reruns
 if "connector" not in st.session_state:
-    st.session_state.connector = IBKRConnector()
+    st.session_state.connector = get_connector()
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
 
@@ -55,8 +185,125 @@ if conn.connected:
 
 # ─── Helpers ────────────────────────────────────────────────────────────────
 
+# Volume-scale columns stay float64: float32 drops whole units above ~16M
+_FLOAT64_COLS = frozenset(("volume", "OBV"))
+
+
+def _to_display_precision(df: pd.DataFrame) -> pd.DataFrame:
+    """Downcast price/indicator columns to float32 for charting.
+
+    Only the copy handed to Plotly is downcast, halving what it serializes.
+    Session frames stay float64: they feed the AI context text, where
+    float32 would print 123.45 as 123.449997, and P/L calculations.
+    """
+    cols = {
+        c: "float32"
+        for c in df.select_dtypes("float64").columns
+        if c not in _FLOAT64_COLS
+    }
+    return df.astype(cols, copy=False) if cols else df
+
+
+# Indicator columns reported for the latest bar in the AI context
+_INDICATOR_COLS = (
+    "RSI_14",
+    "VWAP",
+    "EMA_20",
+    "EMA_50",
+    "EMA_200",
+    "MACD_12_26_9",
+    "MACDh_12_26_9",
+    "MACDs_12_26_9",
+    "BBL_20_2.0",
+    "BBM_20_2.0",
+    "BBU_20_2.0",
+)
+
+
+def _indicator_lines(df: pd.DataFrame) -> list:
+    """Format the latest bar's _INDICATOR_COLS, skipping missing/NaN values."""
+    # One positional row read instead of a label lookup per indicator
+    pos = df.columns.get_indexer(_INDICATOR_COLS)
+    present = pos >= 0
+    vals = np.full(len(_INDICATOR_COLS), np.nan)
+    vals[present] = df.iloc[-1, pos[present]].to_numpy(
+        dtype=np.float64, na_value=np.nan
+    )
+    return [
+        f"  {col}: {v:.4f}"
+        for col, v, ok in zip(_INDICATOR_COLS, vals.tolist(), np.isfinite(vals))
+        if ok
+    ]
+
+
+_OHLC_COLS = ("open", "high", "low", "close")
+_OHLCV_COLS = _OHLC_COLS + ("volume",)
+
+
+def _ohlcv_cols(columns) -> list:
+    """OHLC columns for a bar table, plus volume when the frame has it."""
+    return list(_OHLCV_COLS if "volume" in columns else _OHLC_COLS)
+
+
+# Inclusive days-to-expiry bounds for the AI strategy horizon filter
+_HORIZON_DAYS = {
+    "weekly": (-(10**9), 14),
+    "monthly": (15, 45),
+    "quarterly": (46, 365),
+    "leaps": (366, 10**9),
+}
+
+
+# Session keys _render_market_context() reads; the context is rebuilt only
+# when one of them is replaced (a new fetch), not on every chat message.
+_CONTEXT_KEYS = (
+    "market_meta",
+    "market_df",
+    "market_analysis",
+    "market_holders",
+    "market_financials",
+    "underlying_df",
+    "underlying_analysis",
+)
+
+
+# Bars shown in the context's OHLCV tables
+_CONTEXT_TAIL_BARS = 5
+
+# Words that mark a chat question as being about the market data (EN + IT)
+_MARKET_TERMS = re.compile(
+    r"\b(?:rsi|macd|ema|vwap|bollinger|trend\w*|bar\w*|candel\w*|volum\w*|"
+    r"strateg\w*|option\w*|opzion\w*|greek\w*|grech\w*|delta|gamma|theta|vega|iv|"
+    r"pric\w*|prezz\w*|support\w*|resist\w*|ticker|stock|azion\w*|titol\w*|"
+    r"chart|grafic\w*|pattern\w*|analy\w*|anali\w*|entr\w*|stop|target|"
+    r"long|short|buy|sell|compr\w*|vend\w*|livell\w*|segnal\w*)\b",
+    re.IGNORECASE,
+)
+
+
+def _needs_market_context(user_message, ticker, uploaded_files=None) -> bool:
+    """False for short messages with no market wording (greetings, meta questions)."""
+    if uploaded_files or len(user_message) >= 80:
+        return True
+    if ticker and ticker != "N/A" and ticker.lower() in user_message.lower():
+        return True
+    return _MARKET_TERMS.search(user_message) is not None
+
 
 def _build_market_context() -> str:
+    """Return the AI market context, reusing it while its inputs are unchanged."""
+    inputs = tuple(st.session_state.get(k) for k in _CONTEXT_KEYS)
+    memo = st.session_state.get("_market_context_memo")
+    # Compare by identity: the memo holds the input objects themselves, so
+    # a replaced frame can't be mistaken for the old one via a reused id().
+    if memo is not None and all(a is b for a, b in zip(memo[0], inputs)):
+        return memo[1]
+    context = _render_market_context()
+    st.session_state["_market_context_memo"] = (inputs, context)
+    return context
+
+
+def _render_market_context() -> str:
     """Build a rich text summary of market data for the AI context."""
     meta = st.session_state.get("market_meta", {})
     df = st.session_state.get("market_df")
@@ -79,137 +326,115 @@ def _build_market_context() -> str:
     ]
 
     # Latest bar
-    latest = df.iloc[-1]
-    lines.append("── LATEST BAR ──")
-    lines.append(
+    # One row-to-dict conversion; fields are then plain dict lookups
+    latest = df.iloc[-1].to_dict()
+    df_cols = df.columns
+    lines += [
+        "── LATEST BAR ──",
         f"Open: {latest['open']:.2f}  |  High: {latest['high']:.2f}  |  "
-        f"Low: {latest['low']:.2f}  |  Close: {latest['close']:.2f}"
-    )
-    if "volume" in df.columns and pd.notna(latest.get("volume")):
+        f"Low: {latest['low']:.2f}  |  Close: {latest['close']:.2f}",
+    ]
+    if pd.notna(latest.get("volume")):
         lines.append(f"Volume: {latest['volume']:,.0f}")
 
     # Indicators on latest bar
-    lines.append("")
-    lines.append("── INDICATORS (latest) ──")
-    for col in [
-        "RSI_14",
-        "VWAP",
-        "EMA_20",
-        "EMA_50",
-        "EMA_200",
-        "MACD_12_26_9",
-        "MACDh_12_26_9",
-        "MACDs_12_26_9",
-        "BBL_20_2.0",
-        "BBM_20_2.0",
-        "BBU_20_2.0",
-    ]:
-        if col in df.columns and pd.notna(latest.get(col)):
-            lines.append(f"  {col}: {latest[col]:.4f}")
+    lines += ["", "── INDICATORS (latest) ──", *_indicator_lines(df)]
 
     # Pattern analysis
-    lines.append("")
-    lines.append("── ANALYSIS ──")
-    lines.append(f"Trend: {analysis.get('trend', 'N/A')}")
-    lines.append(f"RSI: {analysis.get('rsi', 'N/A')}")
-    lines.append(f"Patterns: {', '.join(analysis.get('patterns', [])) or 'None'}")
-    lines.append(f"Volume Spike: {analysis.get('volume_spike', False)}")
+    lines += [
+        "",
+        "── ANALYSIS ──",
+        f"Trend: {analysis.get('trend', 'N/A')}",
+        f"RSI: {analysis.get('rsi', 'N/A')}",
+        f"Patterns: {', '.join(analysis.get('patterns', [])) or 'None'}",
+        f"Volume Spike: {analysis.get('volume_spike', False)}",
+    ]
 
     # Add holders info
     holders = st.session_state.get("market_holders", {})
-    if holders.get("institutional_holders") or holders.get("etf_mutualfund_holders"):
-        lines.append("")
-        lines.append("── HOLDERS INFO (TOP 5) ──")
-        if holders.get("institutional_holders"):
-            lines.append("Institutions:")
-            for h in holders["institutional_holders"]:
-                lines.append(f"  - {h['Holder']}: {h['Shares']:,} shares ({h['pctHeld']*100:.2f}%)")
-        if holders.get("etf_mutualfund_holders"):
-            lines.append("ETFs/Mutual Funds:")
-            for h in holders["etf_mutualfund_holders"]:
-                lines.append(f"  - {h['Holder']}: {h['Shares']:,} shares ({h['pctHeld']*100:.2f}%)")
+    institutional = holders.get("institutional_holders")
+    funds = holders.get("etf_mutualfund_holders")
+    if institutional or funds:
+        lines += ["", "── HOLDERS INFO (TOP 5) ──"]
+        for label, group in (("Institutions:", institutional), ("ETFs/Mutual Funds:", funds)):
+            if group:
+                lines.append(label)
+                lines += [
+                    f"  - {h['Holder']}: {h['Shares']:,} shares ({h['pctHeld']*100:.2f}%)"
+                    for h in group
+                ]
 
     # Add financial info
     financials = st.session_state.get("market_financials", {})
     if financials:
-        lines.append("")
-        lines.append("── FINANCIAL FUNDAMENTALS ──")
-        for k, v in financials.items():
-            if isinstance(v, float):
-                # Formattiamo come percentuale se è un margine/ritorno o crescita
-                if any(x in k.lower() for x in ['margin', 'yield', 'return', 'growth']):
-                    lines.append(f"  {k}: {v*100:.2f}%")
-                else:
-                    lines.append(f"  {k}: {v:.2f}")
-            else:
-                lines.append(f"  {k}: {v}")
+        lines += ["", "── FINANCIAL FUNDAMENTALS ──"]
+        # Formattiamo come percentuale se è un margine/ritorno o crescita
+        lines += [
+            f"  {k}: {v*100:.2f}%"
+            if isinstance(v, float) and any(x in k.lower() for x in ("margin", "yield", "return", "growth"))
+            else f"  {k}: {v:.2f}" if isinstance(v, float)
+            else f"  {k}: {v}"
+            for k, v in financials.items()
+        ]
 
-    # Last 10 bars summary (OHLCV table)
-    lines.append("")
-    tail = df.tail(10)
-    cols_to_show = ["open", "high", "low", "close"]
-    if "volume" in df.columns:
-        cols_to_show.append("volume")
-    lines.append(f"── LAST {len(tail)} BARS (OHLCV) ──")
-    lines.append(tail[cols_to_show].to_string())
+    # Last bars summary (OHLCV table)
+    tail = df.tail(_CONTEXT_TAIL_BARS)
+    lines += [
+        "",
+        f"── LAST {len(tail)} BARS (OHLCV) ──",
+        tail[_ohlcv_cols(df_cols)].to_string(),
+    ]
 
     # Include underlying stock data if this is an options analysis
     und_df = st.session_state.get("underlying_df")
     und_analysis = st.session_state.get("underlying_analysis")
     if und_df is not None and not und_df.empty and und_analysis:
-        lines.append("")
-        lines.append("═══════════════════════════════")
-        lines.append("UNDERLYING STOCK DATA")
-        lines.append("═══════════════════════════════")
-        und_latest = und_df.iloc[-1]
-        lines.append(
+        und_latest = und_df.iloc[-1].to_dict()
+        und_tail = und_df.tail(_CONTEXT_TAIL_BARS)
+        lines += [
+            "",
+            "═══════════════════════════════",
+            "UNDERLYING STOCK DATA",
+            "═══════════════════════════════",
             f"Stock Price: {und_latest['close']:.2f}  |  "
-            f"High: {und_latest['high']:.2f}  |  Low: {und_latest['low']:.2f}"
-        )
-        for col in [
-            "RSI_14",
-            "VWAP",
-            "EMA_20",
-            "EMA_50",
-            "EMA_200",
-            "MACD_12_26_9",
-            "MACDh_12_26_9",
-            "MACDs_12_26_9",
-            "BBL_20_2.0",
-            "BBM_20_2.0",
-            "BBU_20_2.0",
-        ]:
-            if col in und_df.columns and pd.notna(und_latest.get(col)):
-                lines.append(f"  {col}: {und_latest[col]:.4f}")
-        lines.append(f"Trend: {und_analysis.get('trend', 'N/A')}")
-        lines.append(f"RSI: {und_analysis.get('rsi', 'N/A')}")
-        lines.append(
-            f"Patterns: {', '.join(und_analysis.get('patterns', [])) or 'None'}"
-        )
-        # Last 10 bars of underlying
-        und_tail = und_df.tail(10)
-        lines.append(f"── LAST {len(und_tail)} BARS (Underlying OHLCV) ──")
-        lines.append(und_tail[["open", "high", "low", "close", "volume"]].to_string())
+            f"High: {und_latest['high']:.2f}  |  Low: {und_latest['low']:.2f}",
+            *_indicator_lines(und_df),
+            f"Trend: {und_analysis.get('trend', 'N/A')}",
+            f"RSI: {und_analysis.get('rsi', 'N/A')}",
+            f"Patterns: {', '.join(und_analysis.get('patterns', [])) or 'None'}",
+            # Last bars of underlying
+            f"── LAST {len(und_tail)} BARS (Underlying OHLCV) ──",
+            und_tail[_ohlcv_cols(und_df.columns)].to_string(),
+        ]
 
     return "\n".join(lines)
 
 
-def _chat_with_ai(user_message: str, uploaded_files=None) -> str:
-    """Send a message to the AI with full market context and optional documents."""
+def _chat_with_ai(user_message: str, uploaded_files=None, stream=False) -> str:
+    """Send a message to the AI with full market context and optional documents.
+
+    With stream=True the answer is also rendered into the current container,
+    token by token when the provider supports streaming.
+    """
     if not TraderAgent:
         return "⚠️ AI Agent not available (agents module not found)."
 
-    context = _build_market_context()
     meta = st.session_state.get("market_meta", {})
     ticker = meta.get("ticker", "N/A")
     timeframe = meta.get("timeframe", "N/A")
+    # Greetings and meta questions go out without the market data block
+    context = (
+        _build_market_context()
+        if _needs_market_context(user_message, ticker, uploaded_files)
+        else None
+    )
 
     # Get selected AI model from session state
     provider_type = st.session_state.get("ai_provider", "gemini")
     model_name = st.session_state.get("ai_model_name")
 
     # Initialize agent to extract appropriate knowledge based on security type
-    agent = TraderAgent(provider_type=provider_type, model_name=model_name)
+    agent = get_trader_agent(provider_type, model_name)
     sec_type = meta.get("sec_type", "STK")
 
     if sec_type == "OPT":
@@ -244,16 +469,18 @@ def _chat_with_ai(user_message: str, uploaded_files=None) -> str:
         role = "User" if msg["role"] == "user" else "Analyst"
         history_text += f"\n{role}: {msg['content']}\n"
 
-    import datetime
-
-    today_str = datetime.date.today().strftime("%Y-%m-%d")
+    data_section = (
+        f"Hai accesso ai seguenti dati di mercato REALI per {ticker} ({timeframe}):\n{context}"
+        if context is not None
+        else ""
+    )
+    today_str = date.today().strftime("%Y-%m-%d")
     text_prompt = f"""{system_role}
 Oggi è il {today_str}.
 I tuoi principi chiave operativi sono basati su questa knowledge base:
 {kb_section}
 
-Hai accesso ai seguenti dati di mercato REALI per {ticker} ({timeframe}):
-{context}
+{data_section}
 
 {'CONVERSAZIONE PRECEDENTE:' + history_text if history_text else ''}
 
@@ -269,23 +496,43 @@ ISTRUZIONI:
 """
 
     # Build multimodal prompt if files are uploaded
-    if uploaded_files:
-        prompt = [text_prompt]
-        for f in uploaded_files:
-            prompt.append({"mime_type": f.type, "data": f.getvalue()})
-    else:
-        prompt = text_prompt
+    file_parts = _file_parts(uploaded_files) if uploaded_files else []
 
     try:
         actual_model = agent.ai.current_model_name
-        print(f"🤖 Chat using: {provider_type} / {actual_model} | KB: {kb_name}")
-        response = agent.ai.get_model().generate_content(prompt)
+        logger.info(
+            "🤖 Chat using: %s / %s | KB: %s", provider_type, actual_model, kb_name
+        )
+        model = agent.ai.get_model()
+        file_keys = [f.file_id for f in uploaded_files] if file_parts else []
+        send, prompt = _chat_sender(
+            model,
+            (provider_type, actual_model),
+            context,
+            text_prompt,
+            user_message,
+            list(zip(file_keys, file_parts)),
+        )
 
         # Build model badge — include LlamaCpp stats if available
         badge_parts = [
             f"*🤖 Model: `{provider_type}` / `{actual_model}`*",
             f"*📚 Knowledge: `{kb_name}`*",
         ]
+
+        if stream and _supports_stream(send):
+            # Render tokens as they arrive instead of after the full answer
+            model_badge = "  |  ".join(badge_parts) + "\n\n---\n\n"
+            st.markdown(model_badge)
+            chunks = send(prompt, stream=True)
+            text = st.write_stream(_chunk_texts(chunks))
+            return model_badge + (text if isinstance(text, str) else "".join(text))
+
+        if stream:
+            with st.spinner("Analyzing..."):
+                response = send(prompt)
+        else:
+            response = send(prompt)
         if hasattr(response, "tokens_per_sec") and response.tokens_per_sec > 0:
             badge_parts.append(f"*⚡ {response.tokens_per_sec:.1f} t/s*")
         if hasattr(response, "total_tokens") and response.total_tokens > 0:
@@ -294,11 +541,145 @@ ISTRUZIONI:
             badge_parts.append(f"*⏱️ {response.duration_sec:.1f}s*")
 
         model_badge = "  |  ".join(badge_parts) + "\n\n---\n\n"
+        if stream:
+            st.markdown(model_badge + response.text)
         return model_badge + response.text
     except Exception as e:
+        # Don't keep a provider session that may have lost this turn
+        st.session_state.pop("_chat_session", None)
+        if stream:
+            st.markdown(f"❌ AI Error ({provider_type}/{model_name}): {e}")
         return f"❌ AI Error ({provider_type}/{model_name}): {e}"
 
 
+def _file_parts(uploaded_files) -> list:
+    """Return the {"mime_type", "data"} parts for the attached files.
+
+    Parts are kept in session state by the uploader's file_id, so an
+    attachment is read once rather than on every chat turn; a re-upload gets
+    a new file_id even under the same name and size.  Files no longer
+    attached are dropped from the cache.
+    """
+    cached = st.session_state.get("uploaded_parts", {})
+    kept = {}
+    for f in uploaded_files:
+        key = f.file_id
+        if key not in kept:
+            kept[key] = cached.get(key) or {"mime_type": f.type, "data": f.getvalue()}
+    st.session_state["uploaded_parts"] = kept
+    return [kept[f.file_id] for f in uploaded_files]
+
+
+def _chat_sender(model, model_key, context, full_prompt, user_message, files=()):
+    """Pick how a chat turn is sent: (send callable, prompt to send).
+
+    Providers whose model offers start_chat() (Gemini) keep the conversation
+    server-side: the full prompt (knowledge base, market context, history)
+    opens a session and later turns send only the question, until the model
+    or the market context changes.  Others get the full prompt every turn.
+    A context of None marks a message sent without market data.
+
+    files lists the attachments as (file_id, part) pairs.  A session
+    already holds the ones it was sent, so only new attachments go with a
+    follow-up turn; one-off prompts always carry all of them.
+    """
+
+    def _with(text, parts):
+        return [text, *parts] if parts else text
+
+    all_parts = [part for _, part in files]
+    if not hasattr(model, "start_chat"):
+        st.session_state.pop("_chat_session", None)
+        return model.generate_content, _with(full_prompt, all_parts)
+    held = st.session_state.get("_chat_session")
+    question = f"DOMANDA DEL TRADER:\n{user_message}"
+
+    def _follow_up():
+        sent = held[3]
+        new = [(k, part) for k, part in files if k not in sent]
+        sent.update(k for k, _ in new)
+        return held[2].send_message, _with(question, [part for _, part in new])
+
+    if context is None:
+        # No market data needed: continue an open session if there is one,
+        # otherwise send a one-off prompt rather than open a data-less session
+        if held is not None and held[0] == model_key:
+            return _follow_up()
+        return model.generate_content, _with(full_prompt, all_parts)
+    # The context string is memoized, so identity means "no new data"
+    if held is not None and held[0] == model_key and held[1] is context:
+        return _follow_up()
+    session = model.start_chat(history=[])
+    st.session_state["_chat_session"] = (
+        model_key, context, session, {k for k, _ in files}
+    )
+    return session.send_message, _with(full_prompt, all_parts)
+
+
+def _reset_chat():
+    """Clear the chat and anything a provider session or memo holds from it."""
+    st.session_state.chat_history = []
+    st.session_state.pop("_chat_session", None)
+    st.session_state.pop("_market_context_memo", None)
+
+
+def _supports_stream(send) -> bool:
+    """True if the provider's send callable takes stream=True."""
+    try:
+        return "stream" in inspect.signature(send).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def _chunk_texts(chunks):
+    """Yield the text of each streamed response chunk, skipping empty ones."""
+    for chunk in chunks:
+        try:
+            text = chunk.text
+        except ValueError:
+            # Gemini raises on chunks without text parts (e.g. safety stops)
+            continue
+        if text:
+            yield text
+
+
+# (column, legend name, dash) for the EMA overlays; colors come from the sidebar
+_EMA_COLS = (
+    ("EMA_20", "EMA 20", None),
+    ("EMA_50", "EMA 50", None),
+    ("EMA_200", "EMA 200", "dash"),
+)
+
+
+def _build_price_figure(df, ticker, title, height, ema_colors):
+    """Candlestick chart of df with its EMA overlays, built in one Figure call."""
+    df = _to_display_precision(df)
+    traces = [
+        go.Candlestick(
+            x=df.index,
+            open=df["open"],
+            high=df["high"],
+            low=df["low"],
+            close=df["close"],
+            name=ticker,
+        )
+    ]
+    traces += [
+        go.Scatter(
+            x=df.index,
+            y=df[col],
+            mode="lines",
+            name=name,
+            line=dict(color=color, width=2, dash=dash),
+        )
+        for (col, name, dash), color in zip(_EMA_COLS, ema_colors)
+        if col in df.columns
+    ]
+    fig = go.Figure(data=traces)
+    fig.update_layout(title=title, height=height)
+    return fig
+
+
 import yfinance as yf
 import pandas as pd
 
@@ -314,12 +695,12 @@ def get_historical_data_with_fallback(connector, ticker, **kwargs):
         try:
             df = connector.get_historical_data(ticker, **kwargs)
         except Exception as e:
-            print(f"IBKR fetch failed for {ticker}: {e}")
+            logger.warning("IBKR fetch failed for %s: %s", ticker, e)
     else:
-        print(f"IBKR not connected, skipping for {ticker}")
+        logger.info("IBKR not connected, skipping for %s", ticker)
 
     if (df is None or df.empty) and sec_type == "STK":
-        print(f"Attempting yfinance fallback for {ticker}")
+        logger.info("Attempting yfinance fallback for %s", ticker)
         try:
             dur = duration.upper().replace(" ", "")
             period_map = {"1D": "5d", "1W": "5d", "1M": "1mo", "3M": "3mo", "6M": "6mo", "1Y": "1y", "2Y": "2y", "5Y": "5y"}
@@ -341,12 +722,86 @@ def get_historical_data_with_fallback(connector, ticker, **kwargs):
                 
                 df = yf_df
                 data_source = "YFinance"
-                print(f"✅ YFinance fallback successful for {ticker}")
+                logger.info("✅ YFinance fallback successful for %s", ticker)
         except Exception as e:
-            print(f"yfinance fallback failed for {ticker}: {e}")
+            logger.warning("yfinance fallback failed for %s: %s", ticker, e)
             
     return df, data_source
 
+
+def get_underlying_and_option_data(connector, ticker, und_kwargs, opt_kwargs):
+    """Fetch an option's underlying and option bars together.
+
+    When IBKR is connected both requests go out concurrently through
+    get_historical_data_many; otherwise (or if that fails) each one goes
+    through get_historical_data_with_fallback in turn.
+
+    Returns:
+        ((und_df, und_source), (opt_df, opt_source))
+    """
+    if connector.connected:
+        und_spec = {"ticker": ticker, **und_kwargs}
+        opt_spec = {"ticker": ticker, **opt_kwargs}
+        opt_key = (ticker, opt_kwargs["expiry"], opt_kwargs["strike"], opt_kwargs["right"])
+        try:
+            res = connector.get_historical_data_many([und_spec, opt_spec])
+        except Exception as e:
+            logger.warning("IBKR batch fetch failed for %s: %s", ticker, e)
+        else:
+            und = (res.get(ticker), "IBKR")
+            if und[0] is None or und[0].empty:
+                # Retry alone so the stock can still fall back to yfinance
+                und = get_historical_data_with_fallback(
+                    connector, ticker, sec_type="STK", **und_kwargs
+                )
+            return und, (res.get(opt_key), "IBKR")
+    return (
+        get_historical_data_with_fallback(connector, ticker, sec_type="STK", **und_kwargs),
+        get_historical_data_with_fallback(connector, ticker, sec_type="OPT", **opt_kwargs),
+    )
+
+
+def get_leg_histories(connector, ticker, legs, duration, bar_size_setting):
+    """Historical bars with indicators for each option leg of a strategy.
+
+    When IBKR is connected all legs are requested concurrently through
+    get_historical_data_many; otherwise (or if that fails) each leg goes
+    through get_history_cached in turn.
+
+    Returns:
+        List of (df, source) aligned with legs; df is None when a leg
+        returned no bars.
+    """
+    if connector.connected:
+        keys = [(ticker, leg["expiry"], leg["strike"], leg["right"]) for leg in legs]
+        try:
+            res = connector.get_historical_data_many(
+                keys, duration=duration, bar_size_setting=bar_size_setting
+            )
+        except Exception as e:
+            logger.warning("IBKR batch leg fetch failed for %s: %s", ticker, e)
+        else:
+            out = []
+            for key in keys:
+                df = res.get(key)
+                out.append(
+                    (add_indicators(df) if df is not None and not df.empty else None, "IBKR")
+                )
+            return out
+    return [
+        get_history_cached(
+            connector,
+            ticker,
+            sec_type="OPT",
+            duration=duration,
+            bar_size_setting=bar_size_setting,
+            strike=leg["strike"],
+            expiry=leg["expiry"],
+            right=leg["right"],
+        )
+        for leg in legs
+    ]
+
 # ─── Sidebar ────────────────────────────────────────────────────────────────
 
 # ── IBKR Gateway Launcher ──
@@ -430,7 +885,14 @@ if not st.session_state.connector.connected and not st.session_state.manual_disc
         pass
 
 if st.session_state.connector.connected:
-    if st.sidebar.button("Disconnect", width="stretch"):
+    # The connector is process-wide (get_connector), so this disconnects
+    # every open session; sessions that did not press it will auto-connect
+    # again on their next rerun.
+    if st.sidebar.button(
+        "Disconnect",
+        width="stretch",
+        help="Closes the shared IBKR connection for all open sessions.",
+    ):
         st.session_state.connector.disconnect()
         st.session_state.manual_disconnect = True
         for k in ["opt_exps", "opt_strikes", "opt_cache_key"]:
@@ -501,7 +963,6 @@ if "archived_sessions" not in st.session_state:
 
 if _prev_ticker is not None and (_prev_ticker != ticker or _prev_sec_type != sec_type):
     # ── Archive current session before clearing ──
-    import datetime as _dt
     _chat = st.session_state.get("chat_history", [])
     _opt_chat = st.session_state.get("opt_strategies_chat", [])
     _strategies = st.session_state.get("ai_strategies", [])
@@ -510,7 +971,7 @@ if _prev_ticker is not None and (_prev_ticker != ticker or _prev_sec_type != sec
         st.session_state.archived_sessions.insert(0, {
             "ticker": _prev_ticker,
             "sec_type": _prev_sec_type,
-            "timestamp": _dt.datetime.now().strftime("%H:%M:%S"),
+            "timestamp": datetime.now().strftime("%H:%M:%S"),
             "chat_history": list(_chat),
             "opt_strategies_chat": list(_opt_chat),
             "ai_strategies": list(_strategies),
@@ -532,10 +993,14 @@ if _prev_ticker is not None and (_prev_ticker != ticker or _prev_sec_type != sec
         "opt_selected_expiry", "opt_selected_strike", "opt_selected_right",
         "opencode_session_id",
         "skill_selector", "selected_skills",
+        "_chat_session", "_market_context_memo", "uploaded_parts",
     ]
     for k in stale_keys:
         st.session_state.pop(k, None)
-    print(f"[CACHE] Archived & cleared: {_prev_ticker}/{_prev_sec_type} → {ticker}/{sec_type}")
+    logger.info(
+        "[CACHE] Archived & cleared: %s/%s → %s/%s",
+        _prev_ticker, _prev_sec_type, ticker, sec_type,
+    )
 st.session_state["_prev_ticker"] = ticker
 st.session_state["_prev_sec_type"] = sec_type
 
@@ -570,6 +1035,7 @@ opencode_active = OpencodeDebate is not None and st.session_state.get("opencode_
 if opencode_active:
     st.sidebar.caption("🤖 Provider LLM disattivati — AI via Opencode Agent")
 elif TraderAgent and AIProvider:
+    _cache_model_lists(AIProvider)
     provider, model = AIProvider.render_streamlit_sidebar()
     st.session_state.ai_provider = provider
     st.session_state.ai_model_name = model
@@ -582,6 +1048,7 @@ if TraderAgent and AIProvider:
         ema200_color = st.color_picker("EMA 200", "#FF1493", key="ema200_color")
 else:
     ema20_color, ema50_color, ema200_color = "#00BFFF", "#FFD700", "#FF1493"
+ema_colors = (ema20_color, ema50_color, ema200_color)
 
 # Opencode Debate History
 if OpencodeDebate:
@@ -689,9 +1156,9 @@ if view_mode == "🎡 Wheel Strategy Scanner":
                         "TraderAgent module not loaded. Check environment/imports."
                     )
                 else:
-                    agent = TraderAgent(
-                        provider_type=st.session_state.get("ai_provider", "gemini"),
-                        model_name=st.session_state.get("ai_model_name"),
+                    agent = get_trader_agent(
+                        st.session_state.get("ai_provider", "gemini"),
+                        st.session_state.get("ai_model_name"),
                     )
 
                     try:
@@ -871,8 +1338,7 @@ elif view_mode == "📊 Earnings Backtester":
                     )
                 except Exception as e:
                     st.error(f"❌ Backtest failed: {e}")
-                    import traceback
-                    traceback.print_exc()
+                    logger.exception("Backtest failed")
                     results = []
 
                 progress_bar.progress(100)
@@ -1020,8 +1486,7 @@ if sec_type == "OPT":
                     text=f"✅ {len(exps)} expirations, {len(strikes)} strikes loaded",
                 )
             except Exception as e:
-                print(f"[ERROR] Option chain fetch failed: {type(e).__name__}: {e}")
-                traceback.print_exc()
+                logger.exception("Option chain fetch failed")
                 progress.progress(100, text="❌ Failed")
                 st.error(str(e))
                 if st.button("🔄 Retry"):
@@ -1031,9 +1496,8 @@ if sec_type == "OPT":
             with st.spinner(f"📡 Fetching {ticker} options via Yahoo Finance..."):
                 try:
                     exps, strikes = get_option_chain_yfinance(ticker)
-                except Exception as e:
-                    print(f"[ERROR] YFinance chain: {type(e).__name__}: {e}")
-                    traceback.print_exc()
+                except Exception:
+                    logger.exception("YFinance chain")
                     exps, strikes = [], []
                 st.session_state["opt_exps"] = exps
                 st.session_state["opt_strikes"] = strikes
@@ -1060,16 +1524,18 @@ if sec_type == "OPT":
 
             # ── AI Strategy Suggestion ──────────────────────────────
             if TraderAgent and AIProvider:
-                import datetime
-
-                today_date = datetime.date.today()
-
-                def get_days_to_exp(exp_str):
-                    try:
-                        exp_date = datetime.datetime.strptime(exp_str, "%Y%m%d").date()
-                        return (exp_date - today_date).days
-                    except:
-                        return 0
+                # Days to each expiration in one vectorized parse; unparsable
+                # dates count as 0 days, as the per-date strptime used to
+                exp_dates = pd.to_datetime(
+                    pd.Index(available_exps, dtype=object), format="%Y%m%d", errors="coerce"
+                )
+                today64 = np.datetime64(date.today(), "D")
+                exp_days = np.where(
+                    exp_dates.isna(),
+                    0,
+                    (exp_dates.values.astype("datetime64[D]") - today64).astype(np.int64),
+                )
+                days_by_exp = dict(zip(available_exps, exp_days.tolist()))
 
                 ai_col1, ai_col2, ai_col3 = st.columns([1, 1, 2])
                 with ai_col1:
@@ -1087,17 +1553,10 @@ if sec_type == "OPT":
                     )
 
                 # Filter Expirations based on Horizon
-                filtered_exps = []
-                for exp in available_exps:
-                    days = get_days_to_exp(exp)
-                    if time_horizon == "weekly" and days <= 14:
-                        filtered_exps.append(exp)
-                    elif time_horizon == "monthly" and 15 <= days <= 45:
-                        filtered_exps.append(exp)
-                    elif time_horizon == "quarterly" and 46 <= days <= 365:
-                        filtered_exps.append(exp)
-                    elif time_horizon == "leaps" and days > 365:
-                        filtered_exps.append(exp)
+                lo, hi = _HORIZON_DAYS[time_horizon]
+                filtered_exps = list(
+                    compress(available_exps, (exp_days >= lo) & (exp_days <= hi))
+                )
 
                 # Fallback if no dates fit the exact bucket
                 if not filtered_exps:
@@ -1107,7 +1566,7 @@ if sec_type == "OPT":
                     selected_exp = st.selectbox(
                         "🎯 Expiration Date",
                         options=sorted(filtered_exps),
-                        format_func=lambda x: f"{datetime.datetime.strptime(x, '%Y%m%d').strftime('%b %d, %Y')} ({get_days_to_exp(x)}d)",
+                        format_func=lambda x: f"{datetime.strptime(x, '%Y%m%d').strftime('%b %d, %Y')} ({days_by_exp.get(x, 0)}d)",
                     )
 
                     # Convert to list to preserve compatibility with existing logic
@@ -1131,7 +1590,7 @@ if sec_type == "OPT":
                     ):
                         try:
                             # Fetch daily data for 1 Year specifically for accurate Historical Volatility (HV)
-                            und_df, _src = get_historical_data_with_fallback(
+                            und_df, _src = get_history_cached(
                                 st.session_state.connector,
                                 ticker,
                                 sec_type="STK",
@@ -1141,7 +1600,6 @@ if sec_type == "OPT":
                             if _src == 'YFinance':
                                 st.warning('⚠️ Using YFinance data (IBKR not connected).')
                             if und_df is not None and not und_df.empty:
-                                und_df = add_indicators(und_df)
                                 und_analysis = detect_patterns(und_df)
                                 price = und_analysis.get("current_price", 0)
 
@@ -1157,20 +1615,17 @@ if sec_type == "OPT":
                                     if specific_strikes:
                                         valid_source_strikes = specific_strikes
 
-                                # Filter strikes near ATM
-                                atm_range = price * 0.10
-                                nearby_strikes = sorted(
-                                    [s for s in valid_source_strikes if abs(s - price) <= atm_range]
-                                )
-                                if len(nearby_strikes) < 4:
-                                    nearby_strikes = sorted(
-                                        valid_source_strikes, key=lambda s: abs(s - price)
-                                    )[:10]
-                                    nearby_strikes = sorted(nearby_strikes)
+                                # Filter strikes near ATM (within 10%, else the 10 closest)
+                                strikes_np = np.asarray(valid_source_strikes, dtype=np.float64)
+                                dist = np.abs(strikes_np - price)
+                                near = np.sort(strikes_np[dist <= price * 0.10])
+                                if near.size < 4:
+                                    near = np.sort(strikes_np[np.argsort(dist, kind="stable")[:10]])
+                                nearby_strikes = near.tolist()
 
                                 closest_strike = (
-                                    min(nearby_strikes, key=lambda s: abs(s - price))
-                                    if nearby_strikes else None
+                                    float(near[np.argmin(np.abs(near - price))])
+                                    if near.size else None
                                 )
 
                                 # ── IV + Greeks via IBKR or YFinance ────────────────
@@ -1195,7 +1650,10 @@ if sec_type == "OPT":
                                         raw_iv = iv
                                         raw_hv = None
                                     if iv is None or iv <= 0:
-                                        iv = und_analysis.get("hist_volatility", historical_volatility(und_df))
+                                        # detect_patterns usually has HV already; only compute it if not
+                                        iv = und_analysis.get("hist_volatility")
+                                        if iv is None:
+                                            iv = historical_volatility(und_df)
                                     last_exp_iv = iv
                                     last_exp_iv_data = iv_data_raw
 
@@ -1223,8 +1681,8 @@ if sec_type == "OPT":
                                         avg_iv, iv_rank = get_iv_rank_yfinance(ticker, best_exp)
                                         last_exp_iv = avg_iv
                                         last_exp_iv_data = {"avg": avg_iv, "iv": avg_iv, "hv": None, "source": "YFinance"}
-                                        exp_greeks = get_option_greeks_from_yfinance(
-                                            ticker, best_exp, nearby_strikes, price
+                                        exp_greeks = get_yf_greeks_cached(
+                                            ticker, best_exp, tuple(nearby_strikes), price
                                         )
                                         if exp_greeks:
                                             greeks_table.extend(exp_greeks)
@@ -1238,7 +1696,7 @@ if sec_type == "OPT":
                                 st.session_state["opt_sentiment"] = sent
 
                                 # ── Build AI context ────────────────────────────────
-                                agent = TraderAgent(provider_type=provider_type, model_name=model_name)
+                                agent = get_trader_agent(provider_type, model_name)
 
                                 m_holders = get_holders_info(ticker)
                                 m_fin = get_financial_info(ticker)
@@ -1296,8 +1754,7 @@ if sec_type == "OPT":
                                 )
                         except Exception as e:
                             st.error(f"❌ AI Strategy Error: {e}")
-                            print(f"[ERROR] AI Strategy: {type(e).__name__}: {e}")
-                            traceback.print_exc()
+                            logger.exception("AI Strategy")
 
                 # Display strategy cards if available
                 if (
@@ -1552,9 +2009,9 @@ if sec_type == "OPT":
                             
                         with st.spinner("🤖 Analizzando le strategie proposte in base alla tua domanda..."):
                             try:
-                                agent = TraderAgent(
-                                    provider_type=st.session_state.get("ai_provider", "gemini"),
-                                    model_name=st.session_state.get("ai_model_name"),
+                                agent = get_trader_agent(
+                                    st.session_state.get("ai_provider", "gemini"),
+                                    st.session_state.get("ai_model_name"),
                                 )
                                 skill_fw = load_skills_knowledge(["options-playbook", "options-course-workbook", "options-crash-course"]) if load_skills_knowledge else {}
                                 kb = "\n\n".join(skill_fw.values()) if skill_fw else getattr(agent, "knowledge", {}).get("options", "")
@@ -1604,7 +2061,7 @@ if sec_type == "OPT":
                             status_placeholder.info(
                                 f"📊 Fetching underlying stock {ticker}..."
                             )
-                            und_df, _src = get_historical_data_with_fallback(
+                            und_df, _src = get_history_cached(
                                 st.session_state.connector,
                                 ticker,
                                 sec_type="STK",
@@ -1614,46 +2071,47 @@ if sec_type == "OPT":
                             if _src == 'YFinance':
                                 st.warning('⚠️ Using YFinance data (IBKR not connected).')
                             if und_df is not None and not und_df.empty:
-                                und_df = add_indicators(und_df)
-                                st.session_state.underlying_df = und_df
                                 st.session_state.underlying_analysis = detect_patterns(
                                     und_df
                                 )
+                                st.session_state.underlying_df = und_df
 
-                            # 2. Fetch each option leg
-                            for leg_idx, leg in enumerate(strat.get("legs", []), 1):
-                                leg_name = f"{leg['right']} {leg['strike']} exp {leg['expiry']}"
-                                status_placeholder.info(
-                                    f"⏳ Fetching Leg {leg_idx}: {leg_name}..."
-                                )
+                            # 2. Fetch the option legs, all at once
+                            legs = strat.get("legs", [])
+                            status_placeholder.info(
+                                f"⏳ Fetching {len(legs)} option legs..."
+                            )
 
-                                opt_duration = duration
-                                opt_timeframe = timeframe
+                            opt_duration = duration
+                            opt_timeframe = timeframe
 
-                                if (
-                                    "day" in opt_timeframe
-                                    or "week" in opt_timeframe
-                                    or "month" in opt_timeframe
-                                ):
-                                    opt_timeframe = "1 hour"
-                                    opt_duration = "1 W"
-                                elif " Y" in opt_duration:
-                                    opt_duration = "1 M"
-                                elif (
-                                    " M" in opt_duration
-                                    and int(opt_duration.split(" ")[0]) > 1
-                                ):
-                                    opt_duration = "1 M"
-
-                                leg_df, _src = get_historical_data_with_fallback(st.session_state.connector, 
-                                    ticker,
-                                    sec_type="OPT",
-                                    duration=opt_duration,  # Safe duration for options
-                                    bar_size_setting=opt_timeframe,  # Safe timeframe for options
-                                    strike=leg["strike"],
-                                    expiry=leg["expiry"],
-                                    right=leg["right"],
-                                )
+                            if (
+                                "day" in opt_timeframe
+                                or "week" in opt_timeframe
+                                or "month" in opt_timeframe
+                            ):
+                                opt_timeframe = "1 hour"
+                                opt_duration = "1 W"
+                            elif " Y" in opt_duration:
+                                opt_duration = "1 M"
+                            elif (
+                                " M" in opt_duration
+                                and int(opt_duration.split(" ")[0]) > 1
+                            ):
+                                opt_duration = "1 M"
+
+                            leg_results = get_leg_histories(
+                                st.session_state.connector,
+                                ticker,
+                                legs,
+                                duration=opt_duration,  # Safe duration for options
+                                bar_size_setting=opt_timeframe,  # Safe timeframe for options
+                            )
+
+                            for leg_idx, (leg, (leg_df, _src)) in enumerate(
+                                zip(legs, leg_results), 1
+                            ):
+                                leg_name = f"{leg['right']} {leg['strike']} exp {leg['expiry']}"
                                 if _src == 'YFinance':
                                     st.warning('⚠️ Using YFinance data (IBKR not connected).')
 
@@ -1669,7 +2127,6 @@ if sec_type == "OPT":
                                 }
 
                                 if leg_df is not None and not leg_df.empty:
-                                    leg_df = add_indicators(leg_df)
                                     leg_data.append({"meta": leg_meta, "df": leg_df})
                                 else:
                                     st.warning(
@@ -1689,8 +2146,7 @@ if sec_type == "OPT":
                             status_placeholder.error(
                                 f"❌ Error fetching strategy data: {e}"
                             )
-                            print(f"[ERROR] Strategy Fetch: {type(e).__name__}: {e}")
-                            traceback.print_exc()
+                            logger.exception("Strategy Fetch")
 
             # ── Manual Selectors (with AI pre-fill) ─────────────────
             # Determine default indices from AI selection or fallback
@@ -1743,45 +2199,42 @@ if st.button("Fetch Data & Analyze", disabled=not can_fetch):
             # Check if we are analyzing a new ticker and clear chat history if so
             current_meta = st.session_state.get("market_meta", {})
             if current_meta.get("ticker") != ticker:
-                st.session_state.chat_history = []
+                _reset_chat()
                 st.session_state.needs_initial_analysis = True
 
             # Clear previous underlying data
             st.session_state.pop("underlying_df", None)
             st.session_state.pop("underlying_analysis", None)
 
-            opt_kwargs = {}
             if sec_type == "OPT":
-                # 1. Fetch the UNDERLYING stock first (user's duration/timeframe)
-                with st.spinner(f"📊 Fetching {ticker} underlying stock data..."):
-                    und_df, _src = get_historical_data_with_fallback(st.session_state.connector, 
+                # Underlying (user's duration/timeframe) and option (safe
+                # defaults) bars are independent, so request them together
+                with st.spinner(f"📊 Fetching {ticker} underlying and option data..."):
+                    (und_df, _und_src), (df, _src) = get_underlying_and_option_data(
+                        st.session_state.connector,
                         ticker,
-                        sec_type="STK",
-                        duration=duration,
-                        bar_size_setting=timeframe,
+                        {"duration": duration, "bar_size_setting": timeframe},
+                        {
+                            "expiry": expiry,
+                            "strike": strike,
+                            "right": right,
+                            "duration": "1 M",
+                            "bar_size_setting": "1 hour",
+                        },
                     )
-                    if _src == 'YFinance':
-                        st.warning('⚠️ Using YFinance data (IBKR not connected).')
-                    if und_df is not None and not und_df.empty:
-                        und_df = add_indicators(und_df)
-                        st.session_state.underlying_df = und_df
-                        st.session_state.underlying_analysis = detect_patterns(und_df)
-
-                # 2. Then fetch the option data (safe defaults)
-                opt_kwargs = {"expiry": expiry, "strike": strike, "right": right}
-                fetch_duration = "1 M"
-                fetch_timeframe = "1 hour"
+                if _und_src == 'YFinance':
+                    st.warning('⚠️ Using YFinance data (IBKR not connected).')
+                if und_df is not None and not und_df.empty:
+                    und_df = add_indicators(und_df)
+                    st.session_state.underlying_analysis = detect_patterns(und_df)
+                    st.session_state.underlying_df = und_df
             else:
-                fetch_duration = duration
-                fetch_timeframe = timeframe
-
-            df, _src = get_historical_data_with_fallback(st.session_state.connector, 
-                ticker,
-                sec_type=sec_type,
-                duration=fetch_duration,
-                bar_size_setting=fetch_timeframe,
-                **opt_kwargs,
-            )
+                df, _src = get_historical_data_with_fallback(st.session_state.connector, 
+                    ticker,
+                    sec_type=sec_type,
+                    duration=duration,
+                    bar_size_setting=timeframe,
+                )
             if _src == 'YFinance':
                 st.warning('⚠️ Using YFinance data (IBKR not connected).')
 
@@ -1806,14 +2259,13 @@ if st.button("Fetch Data & Analyze", disabled=not can_fetch):
                 st.session_state.market_financials = get_financial_info(ticker)
                 
                 # Reset chat and trigger initial analysis
-                st.session_state.chat_history = []
+                _reset_chat()
                 st.session_state.needs_initial_analysis = True
             else:
                 st.warning("No data returned. Check market hours or contract details.")
 
         except Exception as e:
-            print(f"[ERROR] Fetch failed: {type(e).__name__}: {e}")
-            traceback.print_exc()
+            logger.exception("Fetch failed")
             st.error(f"Error ({type(e).__name__}): {e}")
 
 
@@ -2064,7 +2516,7 @@ if "strategy_legs_data" in st.session_state and st.session_state["strategy_legs_
             )
 
         if st.button("🔄 Recalculate & Plot", width="stretch"):
-            from option_utils import compute_greeks_table
+            from option_utils import compute_greeks_legs
 
             # Recalculate the entire greeks table locally based on the tweaker
             # We assume we have the original underlying price and IV
@@ -2073,34 +2525,32 @@ if "strategy_legs_data" in st.session_state and st.session_state["strategy_legs_
                 f"Custom Tweaked: {strat_meta.get('name', '')}"
             )
 
-            # Recompute greeks per leg using Black-Scholes function via compute_greeks_table
+            # Recompute greeks for all legs in one Black-Scholes pass
             # Need to create fresh 'strategy_legs_data' based on this
             new_leg_data_list = []
-            for n_leg in new_legs:
-                # We do a tiny greeks request just for this strike
-                g_table = compute_greeks_table(
-                    und_price, [n_leg["strike"]], n_leg["expiry"], iv, 0.05
-                )
-                if g_table:
-                    # g_table[0] has 'call' and 'put'. Pick the correct one.
-                    g_leg = (
-                        g_table[0]["call"]
-                        if n_leg["right"] == "C"
-                        else g_table[0]["put"]
-                    )
-                    # Build dummy meta bundle
-                    new_meta = {
-                        "name": f"Leg {n_leg['strike']} {n_leg['right']}",
-                        "action": n_leg["action"],
-                        "quantity": n_leg["quantity"],
-                        "strike": n_leg["strike"],
-                        "right": n_leg["right"],
-                        "expiry": n_leg["expiry"],
-                        "greeks": g_leg,
-                    }
-                    new_leg_data_list.append(
-                        {"meta": new_meta, "df": None}
-                    )  # Can't reliably refetch df here synchronously
+            g_rows = compute_greeks_legs(
+                und_price,
+                [n_leg["strike"] for n_leg in new_legs],
+                [n_leg["expiry"] for n_leg in new_legs],
+                iv,
+                0.05,
+            )
+            for n_leg, g_row in zip(new_legs, g_rows):
+                # g_row has 'call' and 'put'. Pick the correct one.
+                g_leg = g_row["call"] if n_leg["right"] == "C" else g_row["put"]
+                # Build dummy meta bundle
+                new_meta = {
+                    "name": f"Leg {n_leg['strike']} {n_leg['right']}",
+                    "action": n_leg["action"],
+                    "quantity": n_leg["quantity"],
+                    "strike": n_leg["strike"],
+                    "right": n_leg["right"],
+                    "expiry": n_leg["expiry"],
+                    "greeks": g_leg,
+                }
+                new_leg_data_list.append(
+                    {"meta": new_meta, "df": None}
+                )  # Can't reliably refetch df here synchronously
 
             st.session_state["selected_strategy"] = recalculated_strategy
             st.session_state["strategy_legs_data"] = new_leg_data_list
@@ -2152,57 +2602,63 @@ if "strategy_legs_data" in st.session_state and st.session_state["strategy_legs_
             f"Breakeven Price(s): {[round(be, 2) for be in breakevens]}\n"
         )
 
-        # Render chat history
-        for msg in st.session_state.strategy_chat:
-            if msg["role"] != "system":  # Don't show hidden contexts
-                with st.chat_message(
-                    msg["role"], avatar="🤖" if msg["role"] == "assistant" else "👤"
-                ):
-                    st.markdown(msg["content"])
+        # Like the market chat panel: a strategy chat message reruns only
+        # this fragment, not the P/L chart and leg tables above.
+        @st.fragment
+        def _strategy_chat_panel():
+            # Render chat history
+            for msg in st.session_state.strategy_chat:
+                if msg["role"] != "system":  # Don't show hidden contexts
+                    with st.chat_message(
+                        msg["role"], avatar="🤖" if msg["role"] == "assistant" else "👤"
+                    ):
+                        st.markdown(msg["content"])
 
-        if strat_user_input := st.chat_input(
-            "Ask about this P/L profile or how to adjust it..."
-        ):
-            st.session_state.strategy_chat.append(
-                {"role": "user", "content": strat_user_input}
-            )
-            with st.chat_message("user", avatar="👤"):
-                st.markdown(strat_user_input)
+            if strat_user_input := st.chat_input(
+                "Ask about this P/L profile or how to adjust it..."
+            ):
+                st.session_state.strategy_chat.append(
+                    {"role": "user", "content": strat_user_input}
+                )
+                with st.chat_message("user", avatar="👤"):
+                    st.markdown(strat_user_input)
 
-            with st.spinner("🤖 Analyzing the generated strategy..."):
-                try:
-                    # Provide system state and short user query to underlying _chat_with_ai or general AI
-                    # Reusing the singleton TraderAgent to get raw text
-                    agent = TraderAgent(
-                        provider_type=st.session_state.get("ai_provider", "gemini"),
-                        model_name=st.session_state.get("ai_model_name"),
-                    )
-                    skill_fw = load_skills_knowledge(["options-playbook", "options-course-workbook", "options-crash-course"]) if load_skills_knowledge else {}
-                    kb = "\n\n".join(skill_fw.values()) if skill_fw else getattr(agent, "knowledge", {}).get("options", "")
-                    kb_section = (
-                        f"\nCONOSCENZA TEORICA (Options Skill Frameworks):\n{kb}\n"
-                        if kb
-                        else ""
-                    )
+                with st.spinner("🤖 Analyzing the generated strategy..."):
+                    try:
+                        # Provide system state and short user query to underlying _chat_with_ai or general AI
+                        # Reusing the singleton TraderAgent to get raw text
+                        agent = get_trader_agent(
+                            st.session_state.get("ai_provider", "gemini"),
+                            st.session_state.get("ai_model_name"),
+                        )
+                        skill_fw = load_skills_knowledge(["options-playbook", "options-course-workbook", "options-crash-course"]) if load_skills_knowledge else {}
+                        kb = "\n\n".join(skill_fw.values()) if skill_fw else getattr(agent, "knowledge", {}).get("options", "")
+                        kb_section = (
+                            f"\nCONOSCENZA TEORICA (Options Skill Frameworks):\n{kb}\n"
+                            if kb
+                            else ""
+                        )
 
-                    prompt = f"Sei un Quantitative Options Analyst. Rispondi in italiano.\nI tuoi principi chiave operativi sono basati su questa knowledge base:\n{kb_section}\n\n{hidden_context}\n\nUser Question: {strat_user_input}"
+                        prompt = f"Sei un Quantitative Options Analyst. Rispondi in italiano.\nI tuoi principi chiave operativi sono basati su questa knowledge base:\n{kb_section}\n\n{hidden_context}\n\nUser Question: {strat_user_input}"
 
-                    response = agent.ai.get_model().generate_content(prompt)
-                    ai_text = response.text
+                        response = agent.ai.get_model().generate_content(prompt)
+                        ai_text = response.text
 
-                    # Add model and knowledge badge to Strategy Chat Analyst
-                    actual_model = agent.ai.current_model_name
-                    provider = st.session_state.get("ai_provider", "gemini")
-                    model_badge = f"*🤖 Model: `{provider}` / `{actual_model}`*  |  *📚 Knowledge: `Opencode Skills (Options)`*\n\n---\n\n"
-                    ai_text = model_badge + ai_text
+                        # Add model and knowledge badge to Strategy Chat Analyst
+                        actual_model = agent.ai.current_model_name
+                        provider = st.session_state.get("ai_provider", "gemini")
+                        model_badge = f"*🤖 Model: `{provider}` / `{actual_model}`*  |  *📚 Knowledge: `Opencode Skills (Options)`*\n\n---\n\n"
+                        ai_text = model_badge + ai_text
 
-                    st.session_state.strategy_chat.append(
-                        {"role": "assistant", "content": ai_text}
-                    )
-                    with st.chat_message("assistant", avatar="🤖"):
-                        st.markdown(ai_text)
-                except Exception as e:
-                    st.error(f"Strategy AI Error: {e}")
+                        st.session_state.strategy_chat.append(
+                            {"role": "assistant", "content": ai_text}
+                        )
+                        with st.chat_message("assistant", avatar="🤖"):
+                            st.markdown(ai_text)
+                    except Exception as e:
+                        st.error(f"Strategy AI Error: {e}")
+
+        _strategy_chat_panel()
 
 elif "market_df" in st.session_state:
     df = st.session_state.market_df
@@ -2218,50 +2674,12 @@ elif "market_df" in st.session_state:
         col_und_chart, col_und_stats = st.columns([3, 1])
 
         with col_und_chart:
-            fig_und = go.Figure(
-                data=[
-                    go.Candlestick(
-                        x=und_df.index,
-                        open=und_df["open"],
-                        high=und_df["high"],
-                        low=und_df["low"],
-                        close=und_df["close"],
-                        name=meta["ticker"],
-                    )
-                ]
-            )
-            if "EMA_20" in und_df.columns:
-                fig_und.add_trace(
-                    go.Scatter(
-                        x=und_df.index,
-                        y=und_df["EMA_20"],
-                        mode="lines",
-                        name="EMA 20",
-                        line=dict(color=ema20_color, width=2),
-                    )
-                )
-            if "EMA_50" in und_df.columns:
-                fig_und.add_trace(
-                    go.Scatter(
-                        x=und_df.index,
-                        y=und_df["EMA_50"],
-                        mode="lines",
-                        name="EMA 50",
-                        line=dict(color=ema50_color, width=2),
-                    )
-                )
-            if "EMA_200" in und_df.columns:
-                fig_und.add_trace(
-                    go.Scatter(
-                        x=und_df.index,
-                        y=und_df["EMA_200"],
-                        mode="lines",
-                        name="EMA 200",
-                        line=dict(color=ema200_color, width=2, dash="dash"),
-                    )
-                )
-            fig_und.update_layout(
-                title=f"{meta['ticker']} Underlying ({meta['timeframe']})", height=500
+            fig_und = _build_price_figure(
+                und_df,
+                meta["ticker"],
+                f"{meta['ticker']} Underlying ({meta['timeframe']})",
+                500,
+                ema_colors,
             )
             st.plotly_chart(fig_und, width="stretch")
 
@@ -2288,50 +2706,12 @@ elif "market_df" in st.session_state:
     col_chart, col_stats = st.columns([3, 1])
 
     with col_chart:
-        fig = go.Figure(
-            data=[
-                go.Candlestick(
-                    x=df.index,
-                    open=df["open"],
-                    high=df["high"],
-                    low=df["low"],
-                    close=df["close"],
-                    name=meta["ticker"],
-                )
-            ]
-        )
-        if "EMA_20" in df.columns:
-            fig.add_trace(
-                go.Scatter(
-                    x=df.index,
-                    y=df["EMA_20"],
-                    mode="lines",
-                    name="EMA 20",
-                    line=dict(color=ema20_color, width=2),
-                )
-            )
-        if "EMA_50" in df.columns:
-            fig.add_trace(
-                go.Scatter(
-                    x=df.index,
-                    y=df["EMA_50"],
-                    mode="lines",
-                    name="EMA 50",
-                    line=dict(color=ema50_color, width=2),
-                )
-            )
-        if "EMA_200" in df.columns:
-            fig.add_trace(
-                go.Scatter(
-                    x=df.index,
-                    y=df["EMA_200"],
-                    mode="lines",
-                    name="EMA 200",
-                    line=dict(color=ema200_color, width=2, dash="dash"),
-                )
-            )
-        fig.update_layout(
-            title=f"{meta['ticker']} Price Chart ({meta['timeframe']})", height=600
+        fig = _build_price_figure(
+            df,
+            meta["ticker"],
+            f"{meta['ticker']} Price Chart ({meta['timeframe']})",
+            600,
+            ema_colors,
         )
         st.plotly_chart(fig, width="stretch")
 
@@ -2391,9 +2771,9 @@ elif "market_df" in st.session_state:
             
             if st.button("Run Geopolitical Analysis", type="primary", key="btn_run_geo"):
                 with st.spinner(f"Analyzing {meta['ticker']} through {geo_framework}..."):
-                    geo_agent = TraderAgent(
-                        provider_type=st.session_state.get("ai_provider", "gemini"),
-                        model_name=st.session_state.get("ai_model_name"),
+                    geo_agent = get_trader_agent(
+                        st.session_state.get("ai_provider", "gemini"),
+                        st.session_state.get("ai_model_name"),
                     )
                     geo_response = geo_agent.analyze_geopolitical_risk(
                         asset=meta['ticker'],
@@ -2512,63 +2892,69 @@ elif "market_df" in st.session_state:
                     {"role": "assistant", "content": ai_response}
                 )
 
-        # Render chat history
-        for msg in st.session_state.chat_history:
-            with st.chat_message(
-                msg["role"], avatar="🤖" if msg["role"] == "assistant" else "👤"
-            ):
-                # Show attached file names if any
-                if msg.get("files"):
-                    st.caption(f"📎 {', '.join(msg['files'])}")
-                st.markdown(msg["content"])
-
-        # Document upload
-        uploaded_files = st.file_uploader(
-            "📎 Attach documents for context (PDF, images)",
-            type=["pdf", "png", "jpg", "jpeg", "webp"],
-            accept_multiple_files=True,
-            key="chat_files",
-        )
-
-        # Chat input
-        if user_input := st.chat_input("Ask the AI analyst about the chart data..."):
-            # Track file names for display
-            file_names = [f.name for f in uploaded_files] if uploaded_files else []
+        # Chat history, attachments and input run as a fragment: sending a
+        # message reruns only this panel, not the charts and stats above.
+        @st.fragment
+        def _chat_panel():
+            # Render chat history
+            for msg in st.session_state.chat_history:
+                with st.chat_message(
+                    msg["role"], avatar="🤖" if msg["role"] == "assistant" else "👤"
+                ):
+                    # Show attached file names if any
+                    if msg.get("files"):
+                        st.caption(f"📎 {', '.join(msg['files'])}")
+                    st.markdown(msg["content"])
 
-            # Add user message
-            st.session_state.chat_history.append(
-                {"role": "user", "content": user_input, "files": file_names}
+            # Document upload
+            uploaded_files = st.file_uploader(
+                "📎 Attach documents for context (PDF, images)",
+                type=["pdf", "png", "jpg", "jpeg", "webp"],
+                accept_multiple_files=True,
+                key="chat_files",
             )
-            with st.chat_message("user", avatar="👤"):
-                if file_names:
-                    st.caption(f"📎 {', '.join(file_names)}")
-                st.markdown(user_input)
-
-            # Get AI response
-            with st.chat_message("assistant", avatar="🤖"):
-                with st.spinner("Analyzing..."):
+
+            # Chat input
+            if user_input := st.chat_input("Ask the AI analyst about the chart data..."):
+                # Track file names for display
+                file_names = [f.name for f in uploaded_files] if uploaded_files else []
+
+                # Add user message
+                st.session_state.chat_history.append(
+                    {"role": "user", "content": user_input, "files": file_names}
+                )
+                with st.chat_message("user", avatar="👤"):
+                    if file_names:
+                        st.caption(f"📎 {', '.join(file_names)}")
+                    st.markdown(user_input)
+
+                # Get AI response
+                with st.chat_message("assistant", avatar="🤖"):
                     _oc_cfg = st.session_state.get("opencode_config")
                     if OpencodeDebate and _oc_cfg is not None:
-                        # Opencode session-based chat
-                        _oc_agent = OpencodeAgent(_oc_cfg)
-                        _sid = st.session_state.get("opencode_session_id")
-                        if _sid is None:
-                            _sid = _oc_agent.create_session()
-                            st.session_state.opencode_session_id = _sid
-                        _response_chunks = []
-                        try:
-                            for _chunk in _oc_agent.stream_chat(user_input, _sid):
-                                _response_chunks.append(_chunk)
-                        except Exception as _e:
-                            ai_response = f"❌ Opencode Error: {_e}"
-                        else:
-                            ai_response = "".join(_response_chunks)
+                        with st.spinner("Analyzing..."):
+                            # Opencode session-based chat
+                            _oc_agent = OpencodeAgent(_oc_cfg)
+                            _sid = st.session_state.get("opencode_session_id")
+                            if _sid is None:
+                                _sid = _oc_agent.create_session()
+                                st.session_state.opencode_session_id = _sid
+                            _response_chunks = []
+                            try:
+                                for _chunk in _oc_agent.stream_chat(user_input, _sid):
+                                    _response_chunks.append(_chunk)
+                            except Exception as _e:
+                                ai_response = f"❌ Opencode Error: {_e}"
+                            else:
+                                ai_response = "".join(_response_chunks)
+                        st.markdown(ai_response)
                     else:
-                        # Traditional AI (via AIProvider)
+                        # Traditional AI (via AIProvider), rendered as it streams in
                         ai_response = _chat_with_ai(
-                            user_input, uploaded_files=uploaded_files or None
+                            user_input, uploaded_files=uploaded_files or None, stream=True
                         )
-                    st.markdown(ai_response)
-            st.session_state.chat_history.append(
-                {"role": "assistant", "content": ai_response}
-            )
+                st.session_state.chat_history.append(
+                    {"role": "assistant", "content": ai_response}
+                )
+
+        _chat_panel()
@@ -1,13 +1,24 @@
 """
 Option utilities — Black-Scholes Greeks + Historical Volatility.
-Uses scipy.stats.norm for cumulative/probability density functions.
+Uses scipy.special.ndtr for the normal CDF and an inlined normal PDF.
 """
 
+import logging
 import math
+from itertools import chain as ichain
 import numpy as np
 import pandas as pd
-from datetime import datetime
-from scipy.stats import norm
+from datetime import date, datetime
+from functools import lru_cache
+from scipy.special import ndtr
+
+logger = logging.getLogger(__name__)
+
+# 1 / sqrt(2 * pi), for the inlined standard normal density
+_INV_SQRT_2PI = 1.0 / math.sqrt(2.0 * math.pi)
+
+# Keys of every greeks dict returned by this module
+_GREEK_KEYS = ("price", "delta", "gamma", "theta", "vega")
 
 
 def black_scholes_greeks(
@@ -32,14 +43,18 @@ def black_scholes_greeks(
     Returns:
         dict with: price, delta, gamma, theta (daily), vega (per 1% vol change)
     """
+    # Streamlit reruns ask for the same contracts again and again; the math
+    # is memoized and each caller still gets its own dict to modify.
+    return dict(
+        zip(_GREEK_KEYS, _black_scholes_greeks(S, K, T_days, r, sigma, option_type))
+    )
+
+
+@lru_cache(maxsize=4096)
+def _black_scholes_greeks(S, K, T_days, r, sigma, option_type) -> tuple:
+    """Values of black_scholes_greeks(), in _GREEK_KEYS order."""
     if T_days <= 0 or S <= 0 or K <= 0 or sigma <= 0:
-        return {
-            "price": 0.0,
-            "delta": 0.0,
-            "gamma": 0.0,
-            "theta": 0.0,
-            "vega": 0.0,
-        }
+        return (0.0, 0.0, 0.0, 0.0, 0.0)
 
     T = T_days / 365.0
     sqrt_T = math.sqrt(T)
@@ -48,9 +63,9 @@ def black_scholes_greeks(
     d2 = d1 - sigma * sqrt_T
 
     # Common terms
-    Nd1 = norm.cdf(d1)
-    Nd2 = norm.cdf(d2)
-    nd1 = norm.pdf(d1)  # Standard normal density
+    Nd1 = ndtr(d1)
+    Nd2 = ndtr(d2)
+    nd1 = _INV_SQRT_2PI * math.exp(-0.5 * d1 * d1)  # Standard normal density
     discount = math.exp(-r * T)
 
     if option_type.upper() == "C":
@@ -58,8 +73,8 @@ def black_scholes_greeks(
         delta = Nd1
         theta = -(S * nd1 * sigma) / (2 * sqrt_T) - r * K * discount * Nd2
     else:  # Put
-        Nmd1 = norm.cdf(-d1)
-        Nmd2 = norm.cdf(-d2)
+        Nmd1 = ndtr(-d1)
+        Nmd2 = ndtr(-d2)
         price = K * discount * Nmd2 - S * Nmd1
         delta = Nd1 - 1  # Negative for puts
         theta = -(S * nd1 * sigma) / (2 * sqrt_T) + r * K * discount * Nmd2
@@ -67,15 +82,87 @@ def black_scholes_greeks(
     gamma = nd1 / (S * sigma * sqrt_T)
     vega = S * nd1 * sqrt_T / 100  # Per 1% change in vol
 
+    return (
+        round(price, 4),
+        round(delta, 4),
+        round(gamma, 4),
+        round(theta / 365, 4),  # Daily theta
+        round(vega, 4),
+    )
+
+
+def black_scholes_chain_vec(
+    S: float,
+    K_arr,
+    T_days,
+    r: float = 0.05,
+    sigma: float = 0.30,
+) -> dict:
+    """
+    Vectorized black_scholes_greeks() for calls and puts over an array of strikes.
+
+    T_days is a day count or an array of them broadcastable against K_arr,
+    so several expiries (e.g. one per leg, or a T[:, None] x K[None, :]
+    grid) are priced in the same pass.  d1/d2, the density and the terms
+    common to both rights are evaluated once and shared; put prices use
+    N(-d1)/N(-d2) like the scalar path.
+
+    Returns {"C": greeks, "P": greeks}, each a dict with the same keys as
+    black_scholes_greeks() holding float64 ndarrays of the broadcast shape
+    (zeros where a strike or expiry is invalid).
+    """
+    K = np.asarray(K_arr, dtype=np.float64)
+    T = np.asarray(T_days, dtype=np.float64) / 365.0
+    if S <= 0 or sigma <= 0:
+        shape = np.broadcast_shapes(K.shape, T.shape)
+        return {
+            right: {k: np.zeros(shape) for k in _GREEK_KEYS} for right in ("C", "P")
+        }
+
+    valid = (K > 0) & (T > 0)
+    K_safe = np.where(valid, K, 1.0)
+    T = np.where(valid, T, 1.0)
+    sqrt_T = np.sqrt(T)
+
+    d1 = (np.log(S / K_safe) + (r + 0.5 * sigma**2) * T) / (sigma * sqrt_T)
+    d2 = d1 - sigma * sqrt_T
+
+    Nd1 = ndtr(d1)
+    Nd2 = ndtr(d2)
+    nd1 = _INV_SQRT_2PI * np.exp(-0.5 * d1 * d1)
+    K_disc = K_safe * np.exp(-r * T)
+
+    call_price = S * Nd1 - K_disc * Nd2
+    decay = -(S * nd1 * sigma) / (2 * sqrt_T)
+    # Shared by both rights
+    gamma = np.where(valid, np.round(nd1 / (S * sigma * sqrt_T), 4), 0.0)
+    vega = np.where(valid, np.round(S * nd1 * sqrt_T / 100, 4), 0.0)
+
+    def _pack(price, delta, theta):
+        return {
+            "price": np.where(valid, np.round(price, 4), 0.0),
+            "delta": np.where(valid, np.round(delta, 4), 0.0),
+            "gamma": gamma,
+            "theta": np.where(valid, np.round(theta / 365, 4), 0.0),
+            "vega": vega,
+        }
+
+    # Puts use N(-d1)/N(-d2) directly, as the scalar path does: deriving them
+    # by parity (C - S + K e^{-rT}) cancels catastrophically deep OTM.
+    Nmd2 = ndtr(-d2)
+    put_price = K_disc * Nmd2 - S * ndtr(-d1)
     return {
-        "price": round(price, 4),
-        "delta": round(delta, 4),
-        "gamma": round(gamma, 4),
-        "theta": round(theta / 365, 4),  # Daily theta
-        "vega": round(vega, 4),
+        "C": _pack(call_price, Nd1, decay - r * K_disc * Nd2),
+        "P": _pack(put_price, Nd1 - 1, decay + r * K_disc * Nmd2),
     }
 
 
+def greeks_rows(cols: dict) -> list:
+    """Split a vectorized greeks dict into one plain-float dict per strike."""
+    names = tuple(cols)
+    return [dict(zip(names, row)) for row in zip(*(cols[n].tolist() for n in names))]
+
+
 def historical_volatility(df: pd.DataFrame, window: int = 20) -> float:
     """
     Calculate annualized historical volatility from a DataFrame with 'close' column.
@@ -87,11 +174,15 @@ def historical_volatility(df: pd.DataFrame, window: int = 20) -> float:
         return 0.30  # Default 30% if not enough data
 
     try:
-        log_returns = np.log(df["close"] / df["close"].shift(1)).dropna()
+        close = df["close"].to_numpy(dtype=np.float64)
+        log_returns = np.diff(np.log(close))
+        log_returns = log_returns[~np.isnan(log_returns)]
         if len(log_returns) < window:
             return 0.30
 
-        hv = log_returns.rolling(window=window).std().iloc[-1]
+        # Only the last window is reported, so take its sample std directly
+        # instead of computing the full rolling series
+        hv = log_returns[-window:].std(ddof=1)
         # Annualize: multiply by sqrt(trading periods per year)
         # For hourly data (6.5h/day * 252 days ≈ 1638), for daily (252)
         # Initialize default to prevent assignment error
@@ -120,12 +211,18 @@ def historical_volatility(df: pd.DataFrame, window: int = 20) -> float:
         return round(float(annualized), 4) if not math.isnan(annualized) else 0.30
 
     except Exception as e:
-        print(f"Historical volatility calculation failed: {e}")
+        logger.warning("Historical volatility calculation failed: %s", e)
         return 0.30
 
 
 def days_to_expiry(expiry_str: str) -> int:
     """Calculate days from now to expiry date string (YYYYMMDD format)."""
+    # The day count only changes at midnight, so cache it per calendar day
+    return _days_to_expiry(expiry_str, date.today().toordinal())
+
+
+@lru_cache(maxsize=512)
+def _days_to_expiry(expiry_str: str, today_ordinal: int) -> int:
     try:
         expiry = datetime.strptime(expiry_str, "%Y%m%d")
         delta = (expiry - datetime.now()).days
@@ -146,26 +243,37 @@ def compute_greeks_table(
     Returns a list of dicts (one per strike, both Call and Put).
     """
     dte = days_to_expiry(expiry_str)
-    results = []
-
-    for strike in strikes:
-        call_greeks = black_scholes_greeks(
-            underlying_price, strike, dte, rate, hist_vol, "C"
-        )
-        put_greeks = black_scholes_greeks(
-            underlying_price, strike, dte, rate, hist_vol, "P"
-        )
-        results.append(
-            {
-                "strike": strike,
-                "expiry": expiry_str,
-                "dte": dte,
-                "call": call_greeks,
-                "put": put_greeks,
-            }
+    table = black_scholes_chain_vec(underlying_price, strikes, dte, rate, hist_vol)
+    return [
+        {"strike": strike, "expiry": expiry_str, "dte": dte, "call": c, "put": p}
+        for strike, c, p in zip(
+            strikes, greeks_rows(table["C"]), greeks_rows(table["P"])
         )
+    ]
 
-    return results
+
+def compute_greeks_legs(
+    underlying_price: float,
+    strikes: list,
+    expiries: list,
+    hist_vol: float,
+    rate: float = 0.05,
+) -> list:
+    """
+    Compute Greeks for (strike, expiry) pairs, e.g. the legs of a strategy.
+
+    Like compute_greeks_table() but each row has its own expiry; all rows
+    are priced in one vectorized pass.  Returns one dict per pair with the
+    same keys as compute_greeks_table() rows.
+    """
+    dtes = [days_to_expiry(e) for e in expiries]
+    table = black_scholes_chain_vec(underlying_price, strikes, dtes, rate, hist_vol)
+    return [
+        {"strike": strike, "expiry": expiry, "dte": dte, "call": c, "put": p}
+        for strike, expiry, dte, c, p in zip(
+            strikes, expiries, dtes, greeks_rows(table["C"]), greeks_rows(table["P"])
+        )
+    ]
 
 
 # ─── YFinance Option Helpers ───────────────────────────────────────────────
@@ -199,16 +307,16 @@ def get_option_chain_yfinance(ticker: str) -> tuple[list[str], list[float]]:
     # Normalize to YYYYMMDD format (same as IBKR)
     exps = sorted(e.replace("-", "") for e in expirations)
     # Collect all strikes across all expirations
-    all_strikes: set[float] = set()
+    strike_cols = []
     for exp in expirations[:5]:  # sample first 5 to avoid rate limits
         try:
             chain = yf_ticker.option_chain(exp)
-            for s in chain.calls["strike"]:
-                all_strikes.add(float(s))
-            for s in chain.puts["strike"]:
-                all_strikes.add(float(s))
+            strike_cols.append(chain.calls["strike"].astype(float).tolist())
+            strike_cols.append(chain.puts["strike"].astype(float).tolist())
         except Exception:
             pass
+    # One set construction over all columns instead of per-element add()
+    all_strikes = set(ichain.from_iterable(strike_cols))
     if not all_strikes:
         return exps, []
     strikes = sorted(all_strikes)
@@ -496,15 +604,15 @@ def vectorized_black_scholes(
     d1 = (np.log(S_safe / K) + (r + 0.5 * sigma**2) * T) / (sigma * sqrt_T)
     d2 = d1 - sigma * sqrt_T
 
-    Nd1 = norm.cdf(d1)
-    Nd2 = norm.cdf(d2)
+    Nd1 = ndtr(d1)
+    Nd2 = ndtr(d2)
     discount = np.exp(-r * T)
 
     if option_type.upper() == "C":
         price_array = S_array * Nd1 - K * discount * Nd2
     else:
-        Nmd1 = norm.cdf(-d1)
-        Nmd2 = norm.cdf(-d2)
+        Nmd1 = ndtr(-d1)
+        Nmd2 = ndtr(-d2)
         price_array = K * discount * Nmd2 - S_array * Nmd1
 
     # Clamp bounds explicitly to exact intrinsic value at bounds